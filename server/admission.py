@@ -0,0 +1,103 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Admission control for the image provider
+#   RateLimiter        token bucket per (client, route class), refuses with the seconds until the next token
+#   ConcurrencyLimiter caps requests being handled at once, static assets may wait in a short bounded queue and
+#                      keep a few slots to themselves so a flood of expensive/junk requests can't starve them
+# Anything refused becomes a 429 with Retry-After in flaskImageProviderApp
+
+from collections import OrderedDict
+import math
+import threading
+import time
+
+STATIC = "static"
+OTHER = "other"
+PRIORITIES = (STATIC, OTHER)
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        # 0 when a token was taken, otherwise the seconds until one is available
+        self.tokens = min(self.burst, self.tokens + (now-self.updated)*self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1-self.tokens) / self.rate
+
+class RateLimiter:
+    def __init__(self, limits: dict[str, tuple[float, float]], maxClients: int=65536):
+        # limits is route class -> (tokens per second, burst), maxClients bounds memory when addresses are spoofed/rotated
+        self.limits = limits
+        self.maxClients = maxClients
+        self.buckets: OrderedDict[tuple, TokenBucket] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, client: str, routeClass: str) -> float:
+        # 0 if allowed, otherwise seconds to wait
+        if routeClass not in self.limits:
+            return 0
+        key = (client, routeClass)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(*self.limits[routeClass])
+                if len(self.buckets) > self.maxClients:
+                    self.buckets.popitem(last=False) # Least recently seen client starts over with a full bucket
+            else:
+                self.buckets.move_to_end(key)
+            return bucket.take(time.monotonic())
+
+class ConcurrencyLimiter:
+    def __init__(self, maxConcurrent: int, maxQueue: int, queueTimeout: float, reservedForStatic: int=1):
+        self.maxConcurrent = maxConcurrent
+        self.maxQueue = maxQueue
+        self.queueTimeout = queueTimeout
+        self.reservedForStatic = min(reservedForStatic, maxConcurrent-1)
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, priority: str) -> bool:
+        with self.condition:
+            limit = self.maxConcurrent if priority == STATIC else self.maxConcurrent - self.reservedForStatic
+            if self.active < limit and (priority == STATIC or self.waiting == 0):
+                self.active += 1
+                return True
+            if priority != STATIC or self.waiting >= self.maxQueue:
+                return False # Only static hits are worth queueing for, everything else is shed straight away
+            self.waiting += 1
+            try:
+                if not self.condition.wait_for(lambda: self.active < limit, timeout=self.queueTimeout):
+                    return False
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def retryAfter(self) -> int:
+        return max(1, math.ceil(self.queueTimeout))
@@ -0,0 +1,197 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Everything the image provider serves, held in memory with its mimetype and validators worked out once
+# Symbols and the favicon are loaded at startup, cards are reloaded whenever readmeManager publishes a new generation
+
+from datetime import datetime, timezone
+import hashlib
+import os
+import threading
+import time
+import magic
+import cardGenerations
+from fileCache import FileCache, MappedFile
+import generator.precompress as precompress
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+SYMBOL_DIRS = {
+    "png": "generator/symbols/png",
+    "webp": "generator/symbols/webp",
+    "svg": "generator/symbols",
+}
+CARD_FILETYPES = ("png", "webp")
+CARD_COUNT = 2
+SPRITE_NAME = "answers" # Written by generator/sprite_sheet.py into every card generation
+SPRITE_FILETYPES = ("png", "webp", "json")
+SYMBOL_CACHE_CONTROL = "public, max-age=86400"
+CARD_CACHE_CONTROL = "public, no-cache" # Same url serves a new card every hour, clients revalidate with the etag
+FAVICON_CACHE_CONTROL = "public, max-age=3600"
+COMPRESSIBLE_MIMETYPES = ("image/svg+xml", "text/html", "application/json", "text/plain") # png/webp/ico are already compressed
+LINK_RECHECK_SECONDS = 5 # With shared state the symlink is still read this often, in case a publish was never announced
+STREAM_MIN_SIZE = 16*1024 # Files at least this big are streamed from fileCache instead of being held as bytes
+
+mimeFind = magic.Magic(mime=True)
+
+files = FileCache()
+
+class Asset:
+    def __init__(self, data: bytes, mimetype: str, mtime: float, cacheControl: str, path: str|None=None, encodings: dict[str, bytes]|None=None, stream: bool=False):
+        self.data = None if stream else data # Streamed assets only keep what's needed to validate and negotiate
+        self.size = len(data)
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self.last_modified = datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+        self.cache_control = cacheControl
+        self.path = path
+        self.encodings = encodings or {} # Content-Encoding -> precompressed body, in preference order
+
+    def body(self, encoding: str|None) -> bytes:
+        return self.data if encoding is None else self.encodings[encoding]
+
+    def sizeFor(self, encoding: str|None) -> int:
+        return self.size if encoding is None else len(self.encodings[encoding])
+
+    def isStreamed(self, encoding: str|None) -> bool:
+        return encoding is None and self.data is None
+
+    def open(self) -> MappedFile:
+        return files.open(self.path, self.etag)
+
+    def etagFor(self, encoding: str|None) -> str:
+        # Each representation needs its own etag or caches could hand a br body to a client that can't read it
+        return self.etag if encoding is None else f"{self.etag}-{encoding}"
+
+    @classmethod
+    def fromFile(cls, path: str, cacheControl: str, mimetype: str|None=None):
+        path = os.path.realpath(path) # Cards go through the generation symlink, the streamed file must be the one that was hashed
+        with open(path, "rb") as f:
+            data = f.read()
+        mimetype = mimetype or mimeFind.from_buffer(data)
+        encodings = precompress.loadVariants(path, data) if mimetype in COMPRESSIBLE_MIMETYPES else {}
+        return cls(data, mimetype, os.path.getmtime(path), cacheControl, path, encodings, stream=len(data) >= STREAM_MIN_SIZE)
+
+def sizeTable(byFiletype: dict[str, dict[int, Asset]]) -> dict[int, list[Asset]]:
+    # id -> every format of that asset, smallest original first, negotiation still compares what each would send
+    table = {}
+    for assets in byFiletype.values():
+        for id, asset in assets.items():
+            table.setdefault(id, []).append(asset)
+    return {id: sorted(assets, key=lambda i: i.size) for id, assets in table.items()}
+
+class AssetStore:
+    def __init__(self, root: str=dname):
+        self.root = root
+        self.symbols: dict[str, dict[int, Asset]] = {}
+        self.symbolsBySize: dict[int, list[Asset]] = {}
+        self.cards: dict[tuple[str, int], Asset] = {}
+        self.cardsBySize: dict[int, list[Asset]] = {}
+        self.sprites: dict[str, Asset] = {}
+        self.favicons: list[Asset] = []
+        self.cardGeneration = None
+        self.cardSequence = 0
+        self.cardChecked = 0
+        self.cardLock = threading.Lock()
+        self.state = None # sharedState.SharedState when started by serverMain
+
+    def load(self, faviconColors: list[tuple]):
+        self.loadSymbols()
+        self.loadFavicons(faviconColors)
+        self.refreshCards()
+
+    def loadSymbols(self):
+        symbols = {}
+        for filetype, folder in SYMBOL_DIRS.items():
+            folder = os.path.join(self.root, folder)
+            symbols[filetype] = {
+                int(name[:-len(filetype)-1]): Asset.fromFile(os.path.join(folder, name), SYMBOL_CACHE_CONTROL)
+                for name in os.listdir(folder) if name.endswith(f".{filetype}") and name[:-len(filetype)-1].isdigit()
+            }
+        self.symbols = symbols
+        self.symbolsBySize = sizeTable(symbols)
+
+    def loadFavicons(self, colors: list[tuple]):
+        # One variant per colour so each one has a stable etag, the route still picks one at random
+        # 70b icon https://github.com/mathiasbynens/small/blob/master/ico.ico
+        path = os.path.join(self.root, "favicon.ico")
+        with open(path, "rb") as f:
+            data = f.read()
+        mtime = os.path.getmtime(path)
+        self.favicons = [
+            Asset(data.replace(b"\xFF\xFF\xFF", bytes(reversed(color))), "image/x-icon", mtime, FAVICON_CACHE_CONTROL) for color in colors
+        ]
+
+    def refreshCards(self):
+        # With shared state a new generation is noticed from one read of its sequence number, otherwise a readlink
+        # The symlink is always what gets loaded, the shared record only says when to look, so a missing or stale
+        # record costs at most LINK_RECHECK_SECONDS. Only reload when the generation actually changed
+        sequence = self.state.sequence() if self.state is not None else 0
+        now = time.monotonic()
+        if sequence and sequence == self.cardSequence and now - self.cardChecked < LINK_RECHECK_SECONDS and len(self.cards):
+            return
+        generation = cardGenerations.currentGeneration()
+        if generation == self.cardGeneration and len(self.cards):
+            self.cardSequence, self.cardChecked = sequence, now
+            return
+        with self.cardLock:
+            if generation == self.cardGeneration and len(self.cards):
+                return
+            cards = {}
+            for filetype in CARD_FILETYPES:
+                cards[filetype] = {}
+                for id in range(CARD_COUNT):
+                    path = os.path.join(cardGenerations.CURRENT_LINK, f"{id}.{filetype}")
+                    if os.path.isfile(path):
+                        cards[filetype][id] = Asset.fromFile(path, CARD_CACHE_CONTROL)
+            sprites = {}
+            for filetype in SPRITE_FILETYPES:
+                path = os.path.join(cardGenerations.CURRENT_LINK, f"{SPRITE_NAME}.{filetype}")
+                if os.path.isfile(path):
+                    sprites[filetype] = Asset.fromFile(path, CARD_CACHE_CONTROL, "application/json" if filetype == "json" else None) # libmagic calls json text/plain
+            self.sprites = sprites
+            self.cardsBySize = sizeTable(cards)
+            self.cards = {(filetype, id): asset for filetype, assets in cards.items() for id, asset in assets.items()} # Swapped in one go so readers never see half a generation
+            self.cardGeneration = generation
+            self.cardSequence, self.cardChecked = sequence, now
+
+    def symbol(self, filetype: str, id: int) -> Asset|None:
+        return self.symbols.get(filetype, {}).get(id)
+
+    def symbolCount(self) -> int:
+        return len(self.symbols.get("png", {}))
+
+    def card(self, filetype: str, id: int) -> Asset|None:
+        self.refreshCards()
+        return self.cards.get((filetype, id))
+
+    def sprite(self, filetype: str) -> Asset|None:
+        self.refreshCards()
+        return self.sprites.get(filetype)
+
+    def spriteVariants(self) -> list[Asset]:
+        self.refreshCards()
+        return sorted((self.sprites[i] for i in CARD_FILETYPES if i in self.sprites), key=lambda i: i.size)
+
+    def symbolVariants(self, id: int) -> list[Asset]:
+        return self.symbolsBySize.get(id, [])
+
+    def cardVariants(self, id: int) -> list[Asset]:
+        self.refreshCards()
+        return self.cardsBySize.get(id, [])
+
+    def favicon(self, index: int) -> Asset:
+        return self.favicons[index % len(self.favicons)]
+
+    def knownFavicon(self, etags) -> Asset|None:
+        # The variant the client already has, if any
+        return next((i for i in self.favicons if etags.contains(i.etag)), None)
@@ -0,0 +1,225 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Asyncio HTTP/1.1 front end for a WSGI app, the alternative to waitress in flaskImageProviderApp.main
+# Sockets are handled on the event loop so slow proxy clients only cost a coroutine, the app itself still runs in a
+# small thread pool so every route and error handler is shared with the waitress mode.
+#   concurrency        app calls running at once, also the thread pool size
+#   maxConnections     open sockets, new ones get a 503 past this
+#   keepAliveTimeout   seconds an idle keep-alive connection is held
+#   writeBufferHigh    bytes queued per connection before we wait for the client to read (backpressure)
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from io import BytesIO
+import sys
+import traceback
+from urllib.parse import unquote_to_bytes
+
+MAX_HEADER_BYTES = 64*1024
+MAX_BODY_BYTES = 1024*1024
+HEADER_TIMEOUT = 10
+INLINE_BODY_BYTES = 64*1024 # Bodies up to this are read out in the same pool call as the app, then written from the loop
+
+class HTTPError(Exception):
+    def __init__(self, status: str):
+        self.status = status
+
+class AsyncWSGIServer:
+    def __init__(self, app, host: str="0.0.0.0", port: int=8080, concurrency: int=16, maxConnections: int=1024, keepAliveTimeout: float=5, writeBufferHigh: int=256*1024):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.maxConnections = maxConnections
+        self.keepAliveTimeout = keepAliveTimeout
+        self.writeBufferHigh = writeBufferHigh
+        self.connections = 0
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="async-wsgi")
+        self.appSlots: asyncio.Semaphore|None = None
+
+    async def start(self) -> asyncio.base_events.Server:
+        self.appSlots = asyncio.Semaphore(self.concurrency)
+        return await asyncio.start_server(self.handleConnection, self.host, self.port, limit=MAX_HEADER_BYTES, backlog=self.maxConnections)
+
+    async def serveForever(self):
+        server = await self.start()
+        print(f"Serving on http://{self.host}:{self.port} (asyncio, {self.concurrency} app threads)")
+        async with server:
+            await server.serve_forever()
+
+    async def handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.transport.set_write_buffer_limits(high=self.writeBufferHigh)
+        self.connections += 1
+        try:
+            if self.connections > self.maxConnections:
+                await self.writeSimple(writer, "503 Service Unavailable", b"Too many connections")
+                return
+            timeout = HEADER_TIMEOUT
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return # Idle keep-alive or the client went away
+                except asyncio.LimitOverrunError:
+                    await self.writeSimple(writer, "431 Request Header Fields Too Large", b"Request headers too large")
+                    return
+                try:
+                    environ, keepAlive = await self.parseRequest(head, reader, writer)
+                except HTTPError as e:
+                    await self.writeSimple(writer, e.status, e.status.encode("latin-1"))
+                    return
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                if not await self.respond(environ, writer, keepAlive):
+                    return
+                timeout = self.keepAliveTimeout
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def parseRequest(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> tuple[dict, bool]:
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, protocol = lines[0].split(" ")
+        except ValueError:
+            raise HTTPError("400 Bad Request")
+        if protocol not in ("HTTP/1.0", "HTTP/1.1"):
+            raise HTTPError("505 HTTP Version Not Supported")
+        path, _, query = target.partition("?")
+        sockname = writer.get_extra_info("sockname") or (self.host, self.port)
+        peername = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method.upper(),
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "RAW_URI": target,
+            "SERVER_NAME": str(sockname[0]),
+            "SERVER_PORT": str(sockname[1]),
+            "SERVER_PROTOCOL": protocol,
+            "REMOTE_ADDR": str(peername[0]),
+            "REMOTE_PORT": str(peername[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise HTTPError("400 Bad Request")
+            key = name.strip().upper().replace("-", "_")
+            value = value.strip()
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            elif "HTTP_" + key in environ:
+                environ["HTTP_" + key] += "," + value
+            else:
+                environ["HTTP_" + key] = value
+        if "chunked" in environ.get("HTTP_TRANSFER_ENCODING", "").lower():
+            raise HTTPError("411 Length Required") # Nothing here takes a body, chunked uploads aren't worth supporting
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            raise HTTPError("400 Bad Request")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError("413 Payload Too Large")
+        body = await reader.readexactly(length) if length else b""
+        environ["wsgi.input"] = BytesIO(body)
+
+        connection = environ.get("HTTP_CONNECTION", "").lower()
+        keepAlive = "keep-alive" in connection if protocol == "HTTP/1.0" else "close" not in connection
+        return environ, keepAlive
+
+    def runApp(self, environ: dict) -> tuple[str, list, object, list, object]:
+        # Runs in the pool, returns (status, headers, body iterable, chunks already read, iterator for the rest or None)
+        # Flask hands back a ClosingIterator for every body, so whether it's small can only be told by reading it,
+        # anything still going after INLINE_BODY_BYTES (file wrappers) keeps being read in the pool chunk by chunk
+        started = []
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+        body = self.app(environ, start_response)
+        iterator = iter(body)
+        chunks, size = [], 0
+        while size <= INLINE_BODY_BYTES and (chunk := next(iterator, None)) is not None: # Apps may defer start_response until the first chunk
+            chunks.append(chunk)
+            size += len(chunk)
+        return started[0], started[1], body, chunks, iterator if size > INLINE_BODY_BYTES else None
+
+    async def respond(self, environ: dict, writer: asyncio.StreamWriter, keepAlive: bool) -> bool:
+        loop = asyncio.get_running_loop()
+        async with self.appSlots: # Bounds app work, connections waiting here only hold a coroutine
+            try:
+                status, headers, body, chunks, rest = await loop.run_in_executor(self.pool, self.runApp, environ)
+            except Exception:
+                traceback.print_exc()
+                await self.writeSimple(writer, "500 Internal Server Error", b"Internal Server Error")
+                return False
+        isHead = environ["REQUEST_METHOD"] == "HEAD"
+        names = {name.lower() for name, _ in headers}
+        chunked = "content-length" not in names and not isHead and environ["SERVER_PROTOCOL"] == "HTTP/1.1" and not status.startswith(("204", "304"))
+        if "content-length" not in names and not chunked and not isHead and not status.startswith(("204", "304")):
+            keepAlive = False # HTTP/1.0 without a length, the end of the body is the end of the connection
+        headers = [*headers, ("Server", "monomatch-asyncio")]
+        if "date" not in names:
+            headers.append(("Date", formatdate(usegmt=True)))
+        if chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        headers.append(("Connection", "keep-alive" if keepAlive else "close"))
+
+        try:
+            writer.write((f"{environ['SERVER_PROTOCOL']} {status}\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers) + "\r\n").encode("latin-1"))
+            if not isHead:
+                for chunk in chunks:
+                    await self.writeChunk(writer, chunk, chunked)
+                if rest is not None: # Large bodies (file wrappers) are read in the pool so file IO never blocks the loop
+                    while (chunk := await loop.run_in_executor(self.pool, next, rest, None)) is not None:
+                        await self.writeChunk(writer, chunk, chunked)
+                if chunked:
+                    writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            return False
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        return keepAlive
+
+    async def writeChunk(self, writer: asyncio.StreamWriter, chunk: bytes, chunked: bool):
+        if not chunk:
+            return
+        if chunked:
+            writer.write(f"{len(chunk):X}\r\n".encode("latin-1") + chunk + b"\r\n")
+        else:
+            writer.write(chunk)
+        await writer.drain() # Waits only while the transport is over writeBufferHigh
+
+    async def writeSimple(self, writer: asyncio.StreamWriter, status: str, body: bytes):
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+def serveAsync(app, host: str="0.0.0.0", port: int=8080, **kwargs):
+    asyncio.run(AsyncWSGIServer(app, host, port, **kwargs).serveForever())
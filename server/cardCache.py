@@ -0,0 +1,129 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Content addressed cache of encoded cards
+# The deck is finite so every card only ever needs rendering once per symbol set + render settings.
+# Entries live in card_cache/<key[:2]>/<key>.<ext>, file mtime doubles as the LRU clock.
+
+import generator.startup as startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+import hashlib
+import json
+import os
+import shutil
+import generator.palette as genPalette
+import generator.deck_file as deck_file
+
+genIm = startup.lazyImport("generator.gen_image") # Cache hits never render or encode
+genEncoder = startup.lazyImport("generator.encoder")
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+CACHE_DIR = os.path.join(dname, "card_cache")
+SYMBOLS_DIR = os.path.join(dname, "generator/symbols")
+CACHE_VERSION = 2 # Bump when the renderer changes in a way the key can't see
+MAX_CACHE_BYTES = 512*1024*1024
+FORMATS = ("png", "webp")
+OUT_DIMENSION = 2048
+DOT_SPACING_MULT = 128
+ENCODE_PRESET = "fast" # Cards are replaced every hour, see generator/encoder.py for the presets
+
+def cardKey(card: list, imageCount: int, outDimension: int=OUT_DIMENSION, dotSpacingMult: int=DOT_SPACING_MULT, preset: str=ENCODE_PRESET) -> str:
+    return hashlib.sha256(json.dumps({
+        "version": CACHE_VERSION,
+        "card": [int(i) for i in card],
+        "symbols": deck_file.symbolSetHash(SYMBOLS_DIR).hex(),
+        "imageCount": int(imageCount),
+        "outDimension": outDimension,
+        "dotSpacingMult": dotSpacingMult,
+        "preset": preset,
+        "palette": hashlib.sha256(genPalette.CARD_PALETTE.tobytes()).hexdigest(),
+    }, sort_keys=True).encode("utf-8")).hexdigest()
+
+def entryPath(key: str, format: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.{format}")
+
+def lookup(key: str) -> dict[str, str]|None:
+    paths = {format: entryPath(key, format) for format in FORMATS}
+    if not all(os.path.isfile(i) for i in paths.values()):
+        return None
+    for path in paths.values():
+        os.utime(path) # Mark as recently used
+    return paths
+
+def getCards(cards: list[list], imageCount: int, evict: bool=True) -> list[dict[str, str]]:
+    # Returns {format: path} for every card, rendering only the ones that aren't cached yet
+    # Misses are encoded together so both formats of every card go through the encoder pool at once
+    keys = [cardKey(card, imageCount) for card in cards]
+    results = [lookup(key) for key in keys]
+    jobs = []
+    for card, key, result in zip(cards, keys, results):
+        if result is None:
+            os.makedirs(os.path.dirname(entryPath(key, FORMATS[0])), exist_ok=True)
+            im = genPalette.quantizeCard(genIm.Card.generateImage(card, imageCount, outDimension=OUT_DIMENSION, dotSpacingMult=DOT_SPACING_MULT).cardImage)
+            jobs += [(im, entryPath(key, format) + f".tmp.{os.getpid()}.{format}") for format in FORMATS]
+    if len(jobs):
+        for result in genEncoder.encodeAll(jobs, preset=ENCODE_PRESET):
+            print(result)
+            os.replace(result.path, result.path.rsplit(".tmp.", 1)[0]) # Only complete files ever get the real name
+        if evict:
+            evictToSize()
+    return [{format: entryPath(key, format) for format in FORMATS} for key in keys]
+
+def copyInto(paths: dict[str, str], outDir: str, name: str):
+    # Hard link when possible so publishing a cached card costs nothing
+    for format, path in paths.items():
+        dest = os.path.join(outDir, f"{name}.{format}")
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+
+def evictToSize(maxBytes: int=MAX_CACHE_BYTES):
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for root, dirs, files in os.walk(CACHE_DIR):
+        for name in files:
+            st = os.stat(os.path.join(root, name))
+            entries.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+    total = sum(i[1] for i in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        os.remove(path)
+        total -= size
+
+def warmCard(job: tuple) -> int:
+    num, card, imageCount = job
+    getCards([card], imageCount, evict=False)
+    return num
+
+if __name__ == "__main__":
+    # Pre-fills the cache with the whole deck: python cardCache.py [--processes N]
+    import argparse
+    import multiprocessing as mp
+    from tqdm import tqdm
+
+    mp.freeze_support()
+    parser = argparse.ArgumentParser(description="Render every card of the deck into the card cache")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes, defaults to every core")
+    args = parser.parse_args()
+
+    cardData, imageCount, _ = deck_file.openDeck(SYMBOLS_DIR)
+    with mp.Pool(processes=args.processes) as pool:
+        for num in tqdm(pool.imap_unordered(warmCard, [(num, card, imageCount) for num,card in enumerate(cardData.card_data)]), total=len(cardData.card_data), unit="card(s)", desc="Warming card cache"):
+            pass
+    evictToSize()
+    print("Done!")
@@ -0,0 +1,89 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Double buffered card sets
+# Cards are rendered into card_generations/<name>, then `cards` is pointed at it with an atomic symlink swap
+# so the web server never sees a half written or missing card. Old generations are kept around for a while
+# so requests that already resolved the old link can finish.
+
+from datetime import datetime
+import json
+import os
+import shutil
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+GENERATIONS_DIR = os.path.join(dname, "card_generations")
+CURRENT_LINK = os.path.join(dname, "cards")
+KEEP_GENERATIONS = 3 # Current one, the one before it for in-flight requests, and a staged one
+RECORD_NAME = "generation.json" # Card ids and cache hashes, what sharedState publishes when the generation goes live
+
+def newGeneration() -> str:
+    # Rendered into a dot directory that listGenerations skips, finishGeneration gives it its real name once complete
+    # so a render that dies halfway can never be picked up as staged
+    name = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    path = os.path.join(GENERATIONS_DIR, f".{name}.tmp")
+    os.makedirs(path)
+    return path
+
+def finishGeneration(path: str) -> str:
+    final = os.path.join(os.path.dirname(path), os.path.basename(path)[1:-len(".tmp")])
+    os.rename(path, final)
+    return final
+
+def listGenerations() -> list[str]:
+    if not os.path.isdir(GENERATIONS_DIR):
+        return []
+    return sorted(i for i in os.listdir(GENERATIONS_DIR) if os.path.isdir(os.path.join(GENERATIONS_DIR, i)) and not i.startswith("."))
+
+def currentGeneration() -> str|None:
+    if not os.path.islink(CURRENT_LINK):
+        return None
+    return os.path.basename(os.readlink(CURRENT_LINK))
+
+def stagedGeneration() -> str|None:
+    # Newest generation that was rendered after the live one, if any
+    current = currentGeneration()
+    staged = [i for i in listGenerations() if current is None or i > current]
+    return os.path.join(GENERATIONS_DIR, staged[-1]) if len(staged) else None
+
+def writeRecord(path: str, cardIds: list[int], cardHashes: list[str]):
+    with open(os.path.join(path, RECORD_NAME), "w") as f:
+        json.dump({"cards": [int(i) for i in cardIds], "hashes": cardHashes, "timestamp": datetime.now().timestamp()}, f)
+
+def readRecord(path: str) -> dict|None:
+    try:
+        with open(os.path.join(path, RECORD_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def publish(path: str):
+    if os.path.isdir(CURRENT_LINK) and not os.path.islink(CURRENT_LINK):
+        shutil.rmtree(CURRENT_LINK) # Left over from before generations existed, a symlink can't replace a real directory
+    tmpLink = CURRENT_LINK + ".tmp"
+    if os.path.lexists(tmpLink):
+        os.remove(tmpLink)
+    os.symlink(os.path.relpath(path, dname), tmpLink, target_is_directory=True)
+    os.replace(tmpLink, CURRENT_LINK) # rename(2) swaps the link atomically
+    prune()
+
+def prune(keep: int=KEEP_GENERATIONS):
+    # Also clears unfinished renders, only the readme process stages and it never prunes mid render
+    if os.path.isdir(GENERATIONS_DIR):
+        for name in os.listdir(GENERATIONS_DIR):
+            if name.startswith(".") and name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(GENERATIONS_DIR, name), ignore_errors=True)
+    current = currentGeneration()
+    for name in listGenerations()[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(GENERATIONS_DIR, name), ignore_errors=True)
@@ -0,0 +1,137 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Ready made error responses
+# Every (code, reason, message, html/json) body is rendered and precompressed once, then served like any other asset,
+# so a scanner hammering bad urls costs a dict lookup instead of a template render and compression per request.
+# Known reasons are built at startup, anything else the first time it's needed.
+
+import json
+import threading
+import time
+from assetStore import Asset
+import generator.precompress as precompress
+
+# Every standard status text defined by mozilla (https://developer.mozilla.org/en-US/docs/Web/HTTP/Status)
+ERROR_MESSAGES = {
+    100: "Continue",
+    101: "Switching Protocols",
+    102: "Processing",
+    103: "Early Hints",
+    200: "OK",
+    201: "Created",
+    202: "Accepted",
+    203: "Non-Authoritative Information",
+    204: "No Content",
+    205: "Reset Content",
+    206: "Partial Content",
+    207: "Multi-Status",
+    208: "Already Reported",
+    226: "IM Used",
+    300: "Multiple Choices",
+    301: "Moved Permanently",
+    302: "Found",
+    303: "See Other",
+    304: "Not Modified",
+    305: "Use Proxy",
+    306: "Unused",
+    307: "Temporary Redirect",
+    308: "Permanent Redirect",
+    400: "Bad Request",
+    401: "Unauthorized",
+    402: "Payment Required",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    406: "Not Acceptable",
+    407: "Proxy Authentication Required",
+    408: "Request Timeout",
+    409: "Conflict",
+    410: "Gone",
+    411: "Length Required",
+    412: "Precondition Failed",
+    413: "Payload Too Large",
+    414: "URI Too Long",
+    415: "Unsupported Media Type",
+    416: "Range Not Satisfiable",
+    417: "Expectation Failed",
+    418: "I'm a teapot",
+    421: "Misdirected Request",
+    422: "Unprocessable Entity",
+    423: "Locked",
+    424: "Failed Dependency",
+    425: "Too Early",
+    426: "Upgrade Required",
+    428: "Precondition Required",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    451: "Unavailable For Legal Reasons",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+    505: "HTTP Version Not Supported",
+    506: "Variant Also Negotiates",
+    507: "Insufficient Storage",
+    508: "Loop Detected",
+    510: "Not Extended",
+    511: "Network Authentication Required",
+}
+UNKNOWN_ERROR_MESSAGE = "Unknown Error"
+CLIENT_ERROR_CACHE_CONTROL = "public, max-age=3600" # A bad url stays bad
+SERVER_ERROR_CACHE_CONTROL = "no-store" # 5xx and 429 are temporary, never let a cache hold on to them
+MAX_ENTRIES = 4096 # Reasons come from our own code so this is never reached, it only bounds a mistake
+
+def messageFor(code: int) -> str:
+    return ERROR_MESSAGES.get(code, UNKNOWN_ERROR_MESSAGE)
+
+def cacheControlFor(code: int) -> str:
+    return SERVER_ERROR_CACHE_CONTROL if code >= 500 or code == 429 else CLIENT_ERROR_CACHE_CONTROL
+
+class ErrorPages:
+    def __init__(self, renderHtml, onCompress=None):
+        # renderHtml(code, message, reason) -> str, onCompress(seconds) is told how long each body took to compress
+        self.renderHtml = renderHtml
+        self.onCompress = onCompress
+        self.pages: dict[tuple, Asset] = {}
+        self.lock = threading.Lock()
+
+    def build(self, code: int, reason: str, message: str|None, html: bool) -> Asset:
+        message = message if message is not None else messageFor(code)
+        if html:
+            data, mimetype = self.renderHtml(code, message, reason).encode("utf-8"), "text/html"
+        else:
+            data, mimetype = json.dumps({"error": message, "errorReason": reason}).encode("utf-8"), "application/json"
+        start = time.perf_counter()
+        encodings = precompress.compressVariants(data)
+        if self.onCompress is not None:
+            self.onCompress(time.perf_counter()-start)
+        return Asset(data, mimetype, time.time(), cacheControlFor(code), encodings=encodings)
+
+    def get(self, code: int, reason: str="", message: str|None=None, html: bool=False) -> Asset:
+        key = (code, reason, message, html)
+        page = self.pages.get(key)
+        if page is None:
+            page = self.build(code, reason, message, html)
+            with self.lock:
+                if len(self.pages) < MAX_ENTRIES:
+                    page = self.pages.setdefault(key, page)
+        return page
+
+    def prebuild(self, errors: list[tuple[int, str]]):
+        for code, reason in errors:
+            for html in (False, True):
+                self.get(code, reason, html=html)
@@ -0,0 +1,80 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Bounded cache of memory mapped files for streaming large assets
+# Each file is opened and mapped once, requests get their own read position over the shared mapping and hand it to
+# wsgi.file_wrapper, so waitress streams straight out of the page cache instead of copying the whole body per request.
+# Evicted mappings aren't closed, they go away once the last in-flight response reading them is done.
+
+from collections import OrderedDict
+import mmap
+import os
+import threading
+
+MAX_OPEN_FILES = 256
+
+class MappedFile:
+    # Minimal read-only file object over a shared mapping, close() leaves the mapping to the cache
+    def __init__(self, mm: mmap.mmap):
+        self.mm = mm
+        self.pos = 0
+
+    def read(self, size: int=-1) -> bytes:
+        end = len(self.mm) if size is None or size < 0 else min(len(self.mm), self.pos+size)
+        data = self.mm[self.pos:end]
+        self.pos = max(self.pos, end)
+        return data
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        match whence:
+            case os.SEEK_SET: self.pos = offset
+            case os.SEEK_CUR: self.pos += offset
+            case os.SEEK_END: self.pos = len(self.mm) + offset
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self):
+        self.mm = None
+
+class FileCache:
+    def __init__(self, maxFiles: int=MAX_OPEN_FILES):
+        self.maxFiles = maxFiles
+        self.maps: OrderedDict[tuple, mmap.mmap] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def open(self, path: str, version: str="") -> MappedFile:
+        # version is part of the key so a replaced file (new card generation, rebuilt symbol) is never served stale
+        key = (path, version)
+        with self.lock:
+            mm = self.maps.get(key)
+            if mm is not None:
+                self.maps.move_to_end(key)
+                return MappedFile(mm)
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # The mapping keeps its own reference, the fd can go
+        with self.lock:
+            mm = self.maps.setdefault(key, mm)
+            self.maps.move_to_end(key)
+            while len(self.maps) > self.maxFiles:
+                self.maps.popitem(last=False)
+        return MappedFile(mm)
+
+    def __len__(self) -> int:
+        return len(self.maps)
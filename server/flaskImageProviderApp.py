@@ -9,6 +9,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import generator.startup as startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
 try:
     match "":
         case "":
@@ -22,16 +26,25 @@ try:
 except:
     print("This program requires libmagic to be installed")
 
-from io import BytesIO
-import json
-from flask import Flask, redirect, Response, request
-from flask_compress import Compress
-from waitress import serve
+from flask import Flask, g, redirect, Response, request
 import os
 from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wsgi import wrap_file
 from jinja2 import Environment, PackageLoader, select_autoescape
 import numpy as np
 import colorsys
+import ipaddress
+import math
+import time
+from assetStore import Asset, AssetStore
+from errorPages import ErrorPages
+import admission
+import metrics
+
+# Only the server for the configured mode gets imported
+waitress = startup.lazyImport("waitress")
+asyncServer = startup.lazyImport("asyncServer")
 
 # Cd to this dir for safety, ensure smooth running
 abspath = os.path.abspath(__file__)
@@ -39,26 +52,9 @@ dname = os.path.dirname(abspath)
 fname = os.path.basename(__file__)
 # os.chdir(dname)
 
+# Nothing is compressed per request, static assets are precompressed at build time (generator/precompress.py)
+# and error pages when errorPages builds them
 app = Flask(__name__)
-app.config.update(
-    {
-        "COMPRESS_MIMETYPES": [
-            "text/html",
-            "image/png",
-            "image/svg+xml",
-            "application/json",
-            "image/x-icon"
-        ],
-        "COMPRESS_LEVEL": 9,
-        "COMPRESS_BR_LEVEL": 11,
-        "COMPRESS_BR_WINDOW": 24,
-        "COMPRESS_BR_BLOCK": 24,
-        "COMPRESS_DEFLATE_LEVEL": 9,
-        "COMPRESS_MIN_SIZE": 50
-    }
-)
-compress = Compress(app)
-mimeFind = magic.Magic(mime=True)
 jinjaEnv = Environment(
     loader=PackageLoader(fname.replace(".py", ""), "templates"),
     autoescape=select_autoescape()
@@ -66,31 +62,188 @@ jinjaEnv = Environment(
 ICON_COLORS = [
     tuple(int(i) for i in colorsys.hsv_to_rgb(i/512*360, .5, 1)*np.array([255, 255, 255])) for i in range(512)
 ]
+assets = AssetStore()
+STREAM_BLOCK_SIZE = 64*1024
+REQUEST_SECONDS = metrics.REGISTRY.histogram("monomatch_http_request_duration_seconds", "Time spent handling a request", ("route",))
+RESPONSES = metrics.REGISTRY.counter("monomatch_http_responses_total", "Responses by route and status code", ("route", "status"))
+BYTES_SENT = metrics.REGISTRY.counter("monomatch_http_response_bytes_total", "Body bytes sent by format and content encoding", ("format", "encoding"))
+COMPRESSION_SECONDS = metrics.REGISTRY.histogram("monomatch_compression_duration_seconds", "Time spent compressing error pages as they're built")
+NOT_MODIFIED_RATIO = metrics.REGISTRY.gauge("monomatch_http_not_modified_ratio", "Share of all responses that were 304 Not Modified")
+RENDER_STAGE_SECONDS = metrics.REGISTRY.gauge("monomatch_card_render_stage_seconds", "Duration of each stage of the last card render, from readmeManager", ("stage",))
+RENDER_RUNS = metrics.REGISTRY.gauge("monomatch_card_render_runs", "Card renders readmeManager has recorded")
+RENDER_LAST = metrics.REGISTRY.gauge("monomatch_card_render_last_timestamp_seconds", "Unix time the last card render finished")
+MIMETYPE_FORMATS = {"image/png": "png", "image/webp": "webp", "image/svg+xml": "svg", "image/x-icon": "ico", "application/json": "json", "text/html": "html"}
+
+def collectMetrics():
+    total = RESPONSES.total()
+    NOT_MODIFIED_RATIO.set(RESPONSES.total(status="304") / total if total else 0)
+    stages = metrics.readRenderStages()
+    if stages is not None:
+        for stage, seconds in stages["stages"].items():
+            RENDER_STAGE_SECONDS.set(seconds, stage=stage)
+        RENDER_RUNS.set(stages["runs"])
+        RENDER_LAST.set(stages["timestamp"])
+metrics.REGISTRY.collectors.append(collectMetrics)
+
+# "waitress" (threaded) or "asyncio" (asyncServer.py), both serve the same app so pick whichever benchmarks better
+SERVER_MODE = os.environ.get("MONOMATCH_SERVER_MODE", "waitress")
+ASYNC_CONCURRENCY = int(os.environ.get("MONOMATCH_ASYNC_CONCURRENCY", 16))
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("MONOMATCH_ASYNC_MAX_CONNECTIONS", 1024))
+ASYNC_KEEP_ALIVE = float(os.environ.get("MONOMATCH_ASYNC_KEEP_ALIVE", 5))
+WAITRESS_THREADS = int(os.environ.get("MONOMATCH_THREADS", 8))
+
+# Admission control, see admission.py. Card/icon/sprite/favicon hits are static, everything else (scans, redirects) isn't
+ADMISSION_ENABLED = os.environ.get("MONOMATCH_ADMISSION", "1") != "0"
+RATE_LIMITS = { # route class -> (requests per second, burst) per client
+    admission.STATIC: (float(os.environ.get("MONOMATCH_STATIC_RATE", 100)), float(os.environ.get("MONOMATCH_STATIC_BURST", 400))), # camo fetches for every viewer from a few addresses
+    admission.OTHER: (float(os.environ.get("MONOMATCH_OTHER_RATE", 2)), float(os.environ.get("MONOMATCH_OTHER_BURST", 20))),
+}
+MAX_CONCURRENT = int(os.environ.get("MONOMATCH_MAX_CONCURRENT", 6)) # Below the thread count so static hits can still queue
+MAX_QUEUE = int(os.environ.get("MONOMATCH_MAX_QUEUE", 16))
+QUEUE_TIMEOUT = float(os.environ.get("MONOMATCH_QUEUE_TIMEOUT", 0.5))
+RESERVED_FOR_STATIC = int(os.environ.get("MONOMATCH_RESERVED_FOR_STATIC", 2))
+TRUSTED_PROXIES = int(os.environ.get("MONOMATCH_TRUSTED_PROXIES", 0)) # Proxies in front that append to X-Forwarded-For, 0 = none
+# !! /metrics is only as private as remote_addr. Behind a reverse proxy on the same host every request arrives from
+# !! 127.0.0.1, so with the default loopback allowlist and MONOMATCH_TRUSTED_PROXIES=0 anyone can scrape it.
+# !! Set MONOMATCH_TRUSTED_PROXIES to the number of proxies in front whenever there are any.
+METRICS_ALLOW = [ # Addresses/networks that may scrape /metrics, comma separated, everyone else gets a plain 404
+    ipaddress.ip_network(i.strip(), strict=False) for i in os.environ.get("MONOMATCH_METRICS_ALLOW", "127.0.0.1,::1").split(",") if i.strip()
+]
+STATIC_ENDPOINTS = ("card", "icon", "sprite", "favicon")
+UNLIMITED_ENDPOINTS = ("metrics_endpoint",)
+rateLimiter = admission.RateLimiter(RATE_LIMITS)
+concurrencyLimiter = admission.ConcurrencyLimiter(MAX_CONCURRENT, MAX_QUEUE, QUEUE_TIMEOUT, RESERVED_FOR_STATIC)
+if TRUSTED_PROXIES:
+    # Only the last TRUSTED_PROXIES entries of X-Forwarded-For were written by our proxies, anything left of them is
+    # whatever the client sent, so remote_addr becomes the address the outermost trusted proxy got the request from
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+ADMISSION_REJECTED = metrics.REGISTRY.counter("monomatch_admission_rejected_total", "Requests refused with a 429, by why and route class", ("reason", "class"))
+ADMISSION_ACTIVE = metrics.REGISTRY.gauge("monomatch_admission_active", "Requests being handled right now")
+ADMISSION_WAITING = metrics.REGISTRY.gauge("monomatch_admission_waiting", "Static requests queued for a slot")
+
+def collectAdmission():
+    ADMISSION_ACTIVE.set(concurrencyLimiter.active)
+    ADMISSION_WAITING.set(concurrencyLimiter.waiting)
+metrics.REGISTRY.collectors.append(collectAdmission)
+
+# (code, reason) of every fixed error the routes raise, prebuilt into errorPages at startup
+ERROR_ACCEPT = (422, "No supported mimetype is marked in the \"Accept\" header")
+ERROR_CARD_FILETYPE = (404, "Filetype not supported, please use png, webp, or auto")
+ERROR_CARD_ID = (404, "Invalid card id, please use 0 or 1")
+ERROR_CARDS_PENDING = (503, "Cards are being generated, try again in a moment")
+ERROR_NO_ICON_ID = (403, "No icon id was provided")
+ERROR_ICON_ID = (403, "Icon id must be a positive whole number")
+ERROR_ICON_PATH = (403, "It seems you may have attempted to use a path to hack this, good try but no.")
+ERROR_ICON_FILETYPE = (404, "Filetype not supported, please use png, webp, svg, or auto")
+ERROR_SPRITE_FILETYPE = (404, "Filetype not supported, please use png, webp, auto, or json")
+ERROR_RATE_LIMITED = (429, "Too many requests, slow down")
+ERROR_OVERLOADED = (429, "The server is busy, try again in a moment")
+KNOWN_ERRORS = [ERROR_ACCEPT, ERROR_CARD_FILETYPE, ERROR_CARD_ID, ERROR_CARDS_PENDING, ERROR_NO_ICON_ID, ERROR_ICON_ID, ERROR_ICON_PATH, ERROR_ICON_FILETYPE, ERROR_SPRITE_FILETYPE, ERROR_RATE_LIMITED, ERROR_OVERLOADED]
+
+def invalidImageReason() -> str:
+    return f"Invalid image ID, valid range is 0-{assets.symbolCount()-1}"
+
+def renderErrorHtml(code: int, message: str, reason: str) -> str:
+    return jinjaEnv.get_template("error_message.html").render(errorCode=code, errorMessage=message, errorReason=reason)
+
+errorPages = ErrorPages(renderErrorHtml, COMPRESSION_SECONDS.observe)
 
 class abortReason (HTTPException):
-    def __init__(self, code: int, reason: str="", overrideErrorMessageText: str=None):
+    def __init__(self, code: int, reason: str="", overrideErrorMessageText: str=None, headers: dict|None=None):
         self.code = code
         self.reason = reason
         self.overrideErrorMessageText = overrideErrorMessageText
+        self.headers = headers or {} # Added to the error response as is, e.g. Retry-After
+
+
+def pick_encoding(asset: Asset) -> str|None:
+    # Best precompressed variant the client accepts, None means send the original
+    best, bestQuality = None, 0
+    for encoding in asset.encodings:
+        quality = request.accept_encodings[encoding]
+        if quality > bestQuality:
+            best, bestQuality = encoding, quality
+    return best
 
+def negotiate_asset(variants: list[Asset]) -> Asset:
+    # Format the client accepts with the fewest bytes on the wire, counting the br/gzip variant it would get
+    accepted = [i for i in variants if not request.accept_mimetypes.provided or request.accept_mimetypes[i.mimetype] > 0]
+    if len(accepted):
+        return min(accepted, key=lambda i: i.sizeFor(pick_encoding(i))) # min keeps the first of equal sizes, smallest original
+    raise abortReason(406, reason=f"None of {', '.join(i.mimetype for i in variants)} are marked in the \"Accept\" header")
+
+def send_asset(asset: Asset, negotiated: bool=False) -> Response:
+    if request.accept_mimetypes.provided and request.accept_mimetypes[asset.mimetype] <= 0: # Same q-value matching as negotiate_asset
+        raise abortReason(*ERROR_ACCEPT)
+    encoding = pick_encoding(asset)
+    if request.method == "HEAD":
+        response = Response(mimetype=asset.mimetype) # Headers only, don't touch the file
+        response.content_length = len(asset.body(encoding)) if not asset.isStreamed(encoding) else asset.size
+    elif asset.isStreamed(encoding):
+        # Large files go through wsgi.file_wrapper over a shared mapping, waitress streams them without a per-request copy
+        response = Response(wrap_file(request.environ, asset.open(), STREAM_BLOCK_SIZE), mimetype=asset.mimetype, direct_passthrough=True)
+        response.content_length = asset.size
+    else:
+        response = Response(asset.body(encoding), mimetype=asset.mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    if len(asset.encodings):
+        response.vary.add("Accept-Encoding")
+    if negotiated:
+        response.vary.add("Accept")
+    response.set_etag(asset.etagFor(encoding))
+    response.last_modified = asset.last_modified
+    response.headers["Cache-Control"] = asset.cache_control
+    # Turns into a 304 when If-None-Match/If-Modified-Since match, or a 206 for a satisfiable Range
+    return response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+
+@app.before_request
+def start_timer():
+    g.requestStart = time.perf_counter()
+
+@app.before_request
+def admit():
+    if not ADMISSION_ENABLED or (request.endpoint in UNLIMITED_ENDPOINTS and metricsAllowed(request.remote_addr)):
+        return # Only allowed scrapers skip the limits, denied probes are limited like any other 404
+    routeClass = admission.STATIC if request.endpoint in STATIC_ENDPOINTS else admission.OTHER
+    client = request.remote_addr # Already the hop our own proxies saw when TRUSTED_PROXIES is set, see ProxyFix below
+    wait = rateLimiter.check(client, routeClass)
+    if wait > 0:
+        ADMISSION_REJECTED.inc(reason="rate", **{"class": routeClass})
+        raise abortReason(*ERROR_RATE_LIMITED, headers={"Retry-After": str(max(1, math.ceil(wait)))})
+    if not concurrencyLimiter.acquire(routeClass):
+        ADMISSION_REJECTED.inc(reason="concurrency", **{"class": routeClass})
+        raise abortReason(*ERROR_OVERLOADED, headers={"Retry-After": str(concurrencyLimiter.retryAfter())})
+    g.admitted = True
+
+@app.teardown_request
+def release_admission(exc):
+    if g.pop("admitted", False):
+        concurrencyLimiter.release()
+
+@app.after_request
+def record_metrics(response: Response) -> Response:
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched" # Raw paths would give scanners unbounded label values
+    if "requestStart" in g:
+        REQUEST_SECONDS.observe(time.perf_counter()-g.requestStart, route=route)
+    RESPONSES.inc(route=route, status=str(response.status_code))
+    if request.method != "HEAD" and response.status_code != 304 and response.content_length:
+        BYTES_SENT.inc(response.content_length, format=MIMETYPE_FORMATS.get(response.mimetype, "other"), encoding=response.content_encoding or "identity")
+    return response
+
+def metricsAllowed(address: str|None) -> bool:
+    try:
+        ip = ipaddress.ip_address(address or "")
+    except ValueError:
+        return False
+    return any(ip in network for network in METRICS_ALLOW)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not metricsAllowed(request.remote_addr): # Same port as the public routes, so only scrapers we know about
+        raise abortReason(404)
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain", content_type="text/plain; version=0.0.4; charset=utf-8")
 
-def send_file(file_path: str) -> Response:
-    mime = mimeFind.from_file(file_path).lower()
-    accepts = request.headers.get("Accept").lower()
-    if accepts.find(mime) == -1 and accepts.find("*/*") == -1:
-        raise abortReason(422, f"No supported mimetype is marked in the \"Accept\" header")
-    return Response(
-        open(file_path, "rb").read() if os.path.isfile(file_path) else "",
-        mimetype=mimeFind.from_file(file_path)
-    )
-
-def render_template(template_path: str, **kwargs):
-    template = jinjaEnv.get_template(template_path)
-    rendered = template.render(**kwargs)
-    return compress.after_request(Response(
-        rendered.encode("utf-8"),
-        mimetype="text/html"
-    ))
 @app.route("/")
 def index():
     return redirect("https://github.com/Vortetty/readme-monomatch", code=308)
@@ -102,137 +255,108 @@ def card(filetype: str, card_id: str|None=None):
         ext = "png"
     elif filetype.lower() == "webp":
         ext = "webp"
+    elif filetype.lower() == "auto":
+        ext = "auto"
     else:
-        raise abortReason(404, reason="Filetype not supported, please use png or webp")
+        raise abortReason(*ERROR_CARD_FILETYPE)
 
-    if int(card_id) == 0:
-        return send_file(os.path.join(dname, f"cards/0.{ext}"))
-    elif int(card_id) == 1:
-        return send_file(os.path.join(dname, f"cards/1.{ext}"))
-    else:
-        raise abortReason(404, reason="Invalid card id, please use 0 or 1")
+    if not card_id.isdigit() or int(card_id) not in (0, 1):
+        raise abortReason(*ERROR_CARD_ID)
+    if ext == "auto":
+        variants = assets.cardVariants(int(card_id))
+        if not len(variants):
+            raise abortReason(*ERROR_CARDS_PENDING)
+        return send_asset(negotiate_asset(variants), negotiated=True)
+    asset = assets.card(ext, int(card_id))
+    if asset is None:
+        raise abortReason(*ERROR_CARDS_PENDING)
+    return send_asset(asset)
 
 @app.route("/monomatch/icon/<filetype>")
 @app.route("/monomatch/icon/<filetype>/<icon_id>")
 def icon(filetype: str, icon_id: str|None=None):
     if icon_id == None:
-        raise abortReason(403, reason="No icon id was provided")
+        raise abortReason(*ERROR_NO_ICON_ID)
     if not icon_id.isdigit() or icon_id.find(".") != -1 or int(icon_id) < 0:
-        raise abortReason(403, reason="Icon id must be a positive whole number")
+        raise abortReason(*ERROR_ICON_ID)
     elif icon_id.find("\\") != -1 or icon_id.find("/") != -1:
-        raise abortReason(403, reason="It seems you may have attempted to use a path to hack this, good try but no.")
+        raise abortReason(*ERROR_ICON_PATH)
 
-    try:
-        if filetype.lower() == "png":
-            return send_file(os.path.join(dname, f"generator/symbols/png/{int(icon_id)}.png"))
-        elif filetype.lower() == "webp":
-            return send_file(os.path.join(dname, f"generator/symbols/webp/{int(icon_id)}.webp"))
-        elif filetype.lower() == "svg":
-            return send_file(os.path.join(dname, f"generator/symbols/{int(icon_id)}.svg"))
-        else:
-            raise abortReason(404, reason="Filetype not supported, please use png, webp, or svg")
-    except FileNotFoundError:
-        raise abortReason(404, reason=f"Invalid image ID, valid range is 0-{len(os.listdir(os.path.join(dname, 'generator/symbols/png')))-1}")
-    except Exception:
-        raise abortReason(500)
-
-@app.errorhandler(abortReason)
-def page_not_found(error: abortReason):
-    errorMessageText = error.overrideErrorMessageText
-    if errorMessageText == None:
-        match error.code: # Match every standard error code defined by mozilla (https://developer.mozilla.org/en-US/docs/Web/HTTP/Status)
-                          # 100, 101, 102, 103
-                          # 200, 201, 202, 203, 204, 205, 206, 207, 208, 226
-                          # 300, 301, 302, 303, 304, 305, 306, 307, 308
-                          # 400, 401, 402, 403, 404, 405, 406, 407, 408, 409, 410, 411, 412, 413, 414, 415, 416, 417, 418, 421, 422, 423, 424, 425, 426, 428, 429, 431, 451
-                          # 500, 501, 502, 503, 504, 505, 506, 507, 508, 510, 511
-            case 100: errorMessageText = "Continue"
-            case 101: errorMessageText = "Switching Protocols"
-            case 102: errorMessageText = "Processing"
-            case 103: errorMessageText = "Early Hints"
-            case 200: errorMessageText = "OK"
-            case 201: errorMessageText = "Created"
-            case 202: errorMessageText = "Accepted"
-            case 203: errorMessageText = "Non-Authoritative Information"
-            case 204: errorMessageText = "No Content"
-            case 205: errorMessageText = "Reset Content"
-            case 206: errorMessageText = "Partial Content"
-            case 207: errorMessageText = "Multi-Status"
-            case 208: errorMessageText = "Already Reported"
-            case 226: errorMessageText = "IM Used"
-            case 300: errorMessageText = "Multiple Choices"
-            case 301: errorMessageText = "Moved Permanently"
-            case 302: errorMessageText = "Found"
-            case 303: errorMessageText = "See Other"
-            case 304: errorMessageText = "Not Modified"
-            case 305: errorMessageText = "Use Proxy"
-            case 306: errorMessageText = "Unused"
-            case 307: errorMessageText = "Temporary Redirect"
-            case 308: errorMessageText = "Permanent Redirect"
-            case 400: errorMessageText = "Bad Request"
-            case 401: errorMessageText = "Unauthorized"
-            case 402: errorMessageText = "Payment Required"
-            case 403: errorMessageText = "Forbidden"
-            case 404: errorMessageText = "Not Found"
-            case 405: errorMessageText = "Method Not Allowed"
-            case 406: errorMessageText = "Not Acceptable"
-            case 407: errorMessageText = "Proxy Authentication Required"
-            case 408: errorMessageText = "Request Timeout"
-            case 409: errorMessageText = "Conflict"
-            case 410: errorMessageText = "Gone"
-            case 411: errorMessageText = "Length Required"
-            case 412: errorMessageText = "Precondition Failed"
-            case 413: errorMessageText = "Payload Too Large"
-            case 414: errorMessageText = "URI Too Long"
-            case 415: errorMessageText = "Unsupported Media Type"
-            case 416: errorMessageText = "Range Not Satisfiable"
-            case 417: errorMessageText = "Expectation Failed"
-            case 418: errorMessageText = "I'm a teapot"
-            case 421: errorMessageText = "Misdirected Request"
-            case 422: errorMessageText = "Unprocessable Entity"
-            case 423: errorMessageText = "Locked"
-            case 424: errorMessageText = "Failed Dependency"
-            case 425: errorMessageText = "Too Early"
-            case 426: errorMessageText = "Upgrade Required"
-            case 428: errorMessageText = "Precondition Required"
-            case 429: errorMessageText = "Too Many Requests"
-            case 431: errorMessageText = "Request Header Fields Too Large"
-            case 451: errorMessageText = "Unavailable For Legal Reasons"
-            case 500: errorMessageText = "Internal Server Error"
-            case 501: errorMessageText = "Not Implemented"
-            case 502: errorMessageText = "Bad Gateway"
-            case 503: errorMessageText = "Service Unavailable"
-            case 504: errorMessageText = "Gateway Timeout"
-            case 505: errorMessageText = "HTTP Version Not Supported"
-            case 506: errorMessageText = "Variant Also Negotiates"
-            case 507: errorMessageText = "Insufficient Storage"
-            case 508: errorMessageText = "Loop Detected"
-            case 510: errorMessageText = "Not Extended"
-            case 511: errorMessageText = "Network Authentication Required"
-            case _:   errorMessageText = "Unknown Error"
-
-    accept = request.headers.get('Accept').lower().split(',')
-    if accept.find('text/html') != -1:
-        return render_template('error_message.html', errorCode=error.code, errorMessage=errorMessageText, errorReason=error.reason), error.code
-    else: # assume json is okay for error messages
-        return json.dumps({"error": errorMessageText, "errorReason": error.reason}), error.code
+    if filetype.lower() not in ("png", "webp", "svg", "auto"):
+        raise abortReason(*ERROR_ICON_FILETYPE)
+    if filetype.lower() == "auto":
+        variants = assets.symbolVariants(int(icon_id))
+        if not len(variants):
+            raise abortReason(404, reason=invalidImageReason())
+        return send_asset(negotiate_asset(variants), negotiated=True)
+    asset = assets.symbol(filetype.lower(), int(icon_id))
+    if asset is None:
+        raise abortReason(404, reason=invalidImageReason())
+    return send_asset(asset)
+
+@app.route("/monomatch/sprite/<filetype>")
+def sprite(filetype: str):
+    # Every symbol on the current card pair in one image, /monomatch/sprite/json says where each one is
+    if filetype.lower() not in ("png", "webp", "auto", "json"):
+        raise abortReason(*ERROR_SPRITE_FILETYPE)
+    if filetype.lower() == "auto":
+        variants = assets.spriteVariants()
+        if not len(variants):
+            raise abortReason(*ERROR_CARDS_PENDING)
+        return send_asset(negotiate_asset(variants), negotiated=True)
+    asset = assets.sprite(filetype.lower())
+    if asset is None:
+        raise abortReason(*ERROR_CARDS_PENDING)
+    return send_asset(asset)
+
+@app.errorhandler(HTTPException)
+def error_page(error: HTTPException):
+    # Our own abortReason errors and werkzeug's (unmatched routes, wrong method) are all served from the prebuilt table
+    html = request.headers.get("Accept", "").lower().find("text/html") != -1
+    page = errorPages.get(error.code, getattr(error, "reason", ""), getattr(error, "overrideErrorMessageText", None), html)
+    encoding = pick_encoding(page)
+    response = Response(page.body(encoding), status=error.code, mimetype=page.mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add("Accept")
+    if len(page.encodings):
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = page.cache_control
+    for name, value in error.get_headers(): # Allow on a 405, Content-Range on a 416, WWW-Authenticate...
+        if name.lower() not in ("content-type", "content-length"): # Those describe werkzeug's own body, not ours
+            response.headers[name] = value
+    response.headers.update(getattr(error, "headers", {}))
+    return response
 
 @app.route('/favicon.ico')
 def favicon():
-    accepts = request.headers.get("Accept").lower()
-    if accepts.find("image/x-icon") == -1 and accepts.find("*/*") == -1:
-        raise abortReason(422, f"No supported mimetype is marked in the \"Accept\" header")
-    return Response(
-        open(os.path.join(dname, 'favicon.ico'), "rb").read().replace(b"\xFF\xFF\xFF", bytes(reversed(ICON_COLORS[np.random.randint(0, 2**31-1, 3)[0]%len(ICON_COLORS)]))),
-        mimetype="image/x-icon"
-    ) # 70b icon https://github.com/mathiasbynens/small/blob/master/ico.ico
+    # Any colour the client already has is fine, send_asset turns it into a 304 with the same validators and caching
+    return send_asset(assets.knownFavicon(request.if_none_match) or assets.favicon(np.random.randint(0, 2**31-1, 3)[0]))
+
+def loadAssets():
+    assets.load(ICON_COLORS)
+    errorPages.prebuild([
+        *KNOWN_ERRORS,
+        (404, invalidImageReason()),
+        (404, ""), # Unmatched urls, most of what scanners hit
+        (405, ""),
+    ])
 
-def main():
-    serve(app, host="0.0.0.0", port=8080)
+def main(state=None, cardData=None, imageCount=None): # Same arguments serverMain gives every process
+    assets.state = state # Picks up published card generations from the shared record
+    if TRUSTED_PROXIES == 0 and all(i.is_loopback for i in METRICS_ALLOW):
+        print("/metrics is allowed for loopback only with MONOMATCH_TRUSTED_PROXIES=0, behind a reverse proxy on this host that's every client, set MONOMATCH_TRUSTED_PROXIES")
+    loadAssets()
+    match SERVER_MODE:
+        case "asyncio":
+            asyncServer.serveAsync(app, host="0.0.0.0", port=8080, concurrency=ASYNC_CONCURRENCY, maxConnections=ASYNC_MAX_CONNECTIONS, keepAliveTimeout=ASYNC_KEEP_ALIVE)
+        case _:
+            waitress.serve(app, host="0.0.0.0", port=8080, threads=WAITRESS_THREADS)
 
 if __name__ == "__main__":
     os.environ.update({
         "FLASK_ENV": "development",
         "FLASK_DEBUG": "1"
     })
+    loadAssets()
     app.run(debug=True, port=8080) #, use_reloader=False)
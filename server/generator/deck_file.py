@@ -0,0 +1,121 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Versioned binary deck file, built once and memory mapped by every server process
+#
+# Layout, all little endian:
+#   header (HEADER below)
+#   cards         card_count x (grid_size+1), int16 or int32
+#   symbol_cards  symbol_count x (grid_size+1), same dtype, the symbol -> cards index
+#   symbol_ids    image_count int32, ids of the svg files in generator/symbols
+# Each array starts on a 64 byte boundary. The header holds a hash of the symbol svgs so a changed symbol set triggers a rebuild.
+#
+# Build it ahead of time with `python -m generator.deck_file` from the server directory, openDeck builds it on demand otherwise
+
+from . import startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+from functools import lru_cache
+import hashlib
+import mmap
+import os
+import struct
+import numpy as np
+from .gen_monomatch_data import CardData
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+SYMBOLS_DIR = os.path.join(dname, "symbols")
+DECK_FILE = os.path.join(dname, "deck.bin")
+DECK_MAGIC = b"MMDECK\x00\x00"
+DECK_VERSION = 1
+HEADER = struct.Struct("<8sIIIIQII32sQQQ") # magic, version, grid_size, symbol_count, image_count, card_count, row_len, itemsize, symbols hash, 3 array offsets
+ALIGN = 64
+
+def symbolIds(symbolsDir: str=SYMBOLS_DIR) -> list[int]:
+    return sorted(int(i[:-4]) for i in os.listdir(symbolsDir) if i.endswith(".svg") and i[:-4].isdigit())
+
+@lru_cache(maxsize=None)
+def symbolSetHash(symbolsDir: str=SYMBOLS_DIR) -> bytes:
+    # Every svg's name and contents, any change to the symbol set changes this
+    h = hashlib.sha256()
+    for id in symbolIds(symbolsDir):
+        h.update(f"{id}.svg".encode("utf-8"))
+        with open(os.path.join(symbolsDir, f"{id}.svg"), "rb") as f:
+            h.update(f.read())
+    return h.digest()
+
+def align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def build(symbolsDir: str=SYMBOLS_DIR, path: str=DECK_FILE):
+    ids = symbolIds(symbolsDir)
+    cardData = CardData.generateCardDataBySymbolCount(len(ids))
+    cards, symbolCards = cardData.cards, cardData.symbol_cards.astype(cardData.cards.dtype)
+    symbolIndex = np.array(ids, dtype="<i4")
+
+    cardsOffset = align(HEADER.size)
+    symbolCardsOffset = align(cardsOffset + cards.nbytes)
+    symbolIndexOffset = align(symbolCardsOffset + symbolCards.nbytes)
+    tmpPath = f"{path}.tmp.{os.getpid()}"
+    with open(tmpPath, "wb") as f:
+        f.write(HEADER.pack(
+            DECK_MAGIC, DECK_VERSION, cardData.grid_size, cardData.symbol_count, len(ids), cardData.card_count,
+            cards.shape[1], cards.dtype.itemsize, symbolSetHash(symbolsDir), cardsOffset, symbolCardsOffset, symbolIndexOffset
+        ))
+        for offset, array in ((cardsOffset, cards), (symbolCardsOffset, symbolCards), (symbolIndexOffset, symbolIndex)):
+            f.seek(offset)
+            f.write(np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes())
+    os.replace(tmpPath, path) # Processes that already mapped the old file keep their pages
+
+def readHeader(path: str=DECK_FILE) -> tuple|None:
+    try:
+        with open(path, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if header[0] != DECK_MAGIC or header[1] != DECK_VERSION:
+        return None
+    return header
+
+def isCurrent(symbolsDir: str=SYMBOLS_DIR, path: str=DECK_FILE) -> bool:
+    header = readHeader(path)
+    return header is not None and header[8] == symbolSetHash(symbolsDir)
+
+def load(path: str=DECK_FILE) -> tuple[CardData, int, np.ndarray]:
+    # Returns (deck, image count, symbol ids), the arrays are read only views straight into the shared mapping
+    header = readHeader(path)
+    if header is None:
+        raise ValueError(f"{path} is not a version {DECK_VERSION} deck file")
+    _, _, gridSize, symbolCount, imageCount, cardCount, rowLen, itemsize, _, cardsOffset, symbolCardsOffset, symbolIndexOffset = header
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    dtype = np.dtype("<i2" if itemsize == 2 else "<i4")
+    cards = np.frombuffer(mm, dtype=dtype, count=cardCount*rowLen, offset=cardsOffset).reshape(cardCount, rowLen)
+    symbolCards = np.frombuffer(mm, dtype=dtype, count=symbolCount*rowLen, offset=symbolCardsOffset).reshape(symbolCount, rowLen)
+    ids = np.frombuffer(mm, dtype="<i4", count=imageCount, offset=symbolIndexOffset)
+    cardData = CardData(symbolCount, cardCount, cards, gridSize, symbol_cards=symbolCards, source_path=path)
+    return cardData, imageCount, ids
+
+def loadCardData(path: str=DECK_FILE) -> CardData:
+    return load(path)[0]
+
+def openDeck(symbolsDir: str=SYMBOLS_DIR, path: str=DECK_FILE) -> tuple[CardData, int, np.ndarray]:
+    if not isCurrent(symbolsDir, path):
+        print("Symbols changed or no deck file, rebuilding it")
+        build(symbolsDir, path)
+    return load(path)
+
+if __name__ == "__main__":
+    build()
+    print(f"Wrote {DECK_FILE}")
@@ -0,0 +1,79 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Shared PNG/WebP encoding for cards and symbols
+# Pillow drops the GIL while zlib/libwebp run so a thread pool is enough to encode every output at once
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+import time
+from PIL import Image
+
+PRESETS = {
+    "fast": { # Hourly card rotation
+        "png": {"optimize": False, "compress_level": 6},
+        "webp": {"lossless": True, "method": 1, "quality": 50},
+    },
+    "balanced": {
+        "png": {"optimize": False, "compress_level": 9},
+        "webp": {"lossless": True, "method": 4, "quality": 80},
+    },
+    "max": { # Offline builds, same settings everything used before presets existed
+        "png": {"optimize": True},
+        "webp": {"lossless": True, "method": 6, "quality": 100},
+    },
+}
+
+class EncodeResult:
+    def __init__(self, path: str, format: str, preset: str, size: int, seconds: float):
+        self.path = path
+        self.format = format
+        self.preset = preset
+        self.size = size
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        return f"{self.path} ({self.format}/{self.preset}): {self.size} bytes in {self.seconds*1000:.1f}ms"
+
+def formatFor(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext not in ("png", "webp"):
+        raise ValueError(f"Don't know how to encode {path}, only png and webp are supported")
+    return ext
+
+def encodeImage(im: Image.Image, path: str, preset: str="max") -> EncodeResult:
+    format = formatFor(path)
+    start = time.perf_counter()
+    if format == "webp" and im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGBA") # WebP can't take palette images
+    with BytesIO() as f:
+        im.save(f, format=format.upper(), **PRESETS[preset][format])
+        data = f.getvalue()
+    with open(path, "wb") as f:
+        f.write(data)
+    return EncodeResult(path, format, preset, len(data), time.perf_counter()-start)
+
+def encodeAll(jobs: list[tuple[Image.Image, str]], preset: str="max", workers: int|None=None) -> list[EncodeResult]:
+    # jobs are (image, output path) pairs, the format comes from the extension, results keep the job order
+    # save() loads and touches the image's internal state and Pillow doesn't promise that's safe from two threads,
+    # so every job after the first one on an image gets its own copy, made here before any thread starts
+    seen = set()
+    ownJobs = []
+    for im, path in jobs:
+        ownJobs.append((im.copy() if id(im) in seen else im, path))
+        seen.add(id(im))
+    with ThreadPoolExecutor(max_workers=workers or len(jobs) or 1) as pool:
+        return list(pool.map(lambda job: encodeImage(*job, preset=preset), ownJobs))
@@ -11,6 +11,10 @@
 
 # Single threaded, could be improved with multiprocessing but until I need it, I'll stick to this.
 
+import startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
 from io import BytesIO
 import os
 import colorsys
@@ -21,6 +25,10 @@ import numpy as np
 from PIL import Image
 import cairosvg as csvg
 import multiprocessing as mp
+# This runs as a script, so the generator modules it shares are imported top level and must not use relative imports
+import symbol_mips
+import encoder
+import precompress
 
 def sizeof_fmt(num, suffix="B"):
     for unit in ["", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"]:
@@ -46,12 +54,20 @@ def importSvg(id: int):
         im = im.crop(im.getbbox())
         im = recolorImage(im, COLORS[id%len(COLORS)])
         return im
+def genMipLevels(id: int):
+    for size in symbol_mips.MIP_SIZES:
+        with BytesIO() as f:
+            csvg.svg2png(url=f"./symbols/{id}.svg", write_to=f, output_height=size)
+            im = Image.open(f)
+            im = symbol_mips.fillColor(im.crop(im.getbbox()), COLORS[id%len(COLORS)])
+            im.save(symbol_mips.mipPath("symbols", id, size))
 def genImages(fileList: list, threadNum: int, offset: int):
     for i,file in tqdm(enumerate(fileList), total=len(fileList), unit="file(s)", desc=f"Generating files (T-{hex(threadNum+1).upper().replace('X', 'x')})", position=threadNum, leave=False):
         shutil.copyfile(f"in_symbols/{file}", f"symbols/{i+offset}.svg")
+        precompress.precompressFile(f"symbols/{i+offset}.svg")
         im = importSvg(i+offset)
-        im.save(f"symbols/png/{i+offset}.png", optimize=True)
-        im.convert("RGBA").save(f"symbols/webp/{i+offset}.webp", lossless=True, method=6, quality=100)
+        encoder.encodeAll([(im, f"symbols/png/{i+offset}.png"), (im, f"symbols/webp/{i+offset}.webp")], preset="max")
+        genMipLevels(i+offset)
 
 def genImagesMP(j):
     genImages(*j)
@@ -67,6 +83,8 @@ if __name__ == "__main__": # Windows is dumb and mp needs a guard
     os.mkdir("symbols")
     os.mkdir("symbols/png")
     os.mkdir("symbols/webp")
+    for size in symbol_mips.MIP_SIZES:
+        os.makedirs(os.path.dirname(symbol_mips.mipPath("symbols", 0, size)))
 
     svgFiles = [f for f in os.listdir("in_symbols") if f.endswith(".svg")]
     fileCount = len(svgFiles)
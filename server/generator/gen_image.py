@@ -14,19 +14,17 @@ if __name__ == "__main__":
     exit(1)
 
 from io import BytesIO
-from itertools import combinations
-from turtle import dot
-from types import NoneType
-from xmlrpc.client import Boolean
-import poisson_disc as pd
+from functools import lru_cache
 import numpy as np
 from PIL import Image, ImageDraw
-import cairosvg as csvg
 import colorsys
-from . import smallestenclosingcircle as sec
-from tqdm import tqdm
+from . import layout
+from . import symbol_mips
+from . import startup
 import os
 
+csvg = startup.lazyImport("cairosvg") # Only for symbols without a prerendered mip, loading cairo is a third of a second
+
 class dummyTqdm:
     def __init__(self, *args, **kwargs):
         # Dummy function
@@ -36,6 +34,24 @@ class dummyTqdm:
         # Dummy function
         pass
 
+@lru_cache(maxsize=4)
+def cachedCardBackground(outDimension: int) -> Image.Image:
+    # Shared between cards, only ever read it, see cardBackground
+    bg_im = Image.new('RGBA', (outDimension, outDimension), (0, 0, 0, 0))
+    bg_draw = ImageDraw.Draw(bg_im)
+    bg_draw.ellipse((0, 0, outDimension, outDimension), fill=(40, 42, 54), outline=(30, 32, 44), width=int((128/4096*outDimension)/2))
+    return bg_im
+
+def cardBackground(outDimension: int) -> Image.Image:
+    # Drawing the disk is the expensive part, copying it is cheap and keeps callers from changing every later card
+    return cachedCardBackground(outDimension).copy()
+
+def pasteOver(dest: Image.Image, im: Image.Image, pos: tuple):
+    # Proper "over" compositing, paste() with the image as its own mask eats into the alpha of an opaque canvas
+    # alpha_composite won't take negative offsets so crop off anything hanging over the top/left edge first
+    cropX, cropY = max(0, -pos[0]), max(0, -pos[1])
+    dest.alpha_composite(im.crop((cropX, cropY, *im.size)), (pos[0]+cropX, pos[1]+cropY))
+
 class Card:
     def __init__(self, cardData: list, cardSymbolCount: int, deckSymbolCount: int, cardImageDimensions: tuple, cardImage: Image.Image, cardFgImage: Image.Image, cardBgImage: Image.Image, givenDotSpacingMult: int):
         self.cardData = cardData
@@ -48,7 +64,7 @@ class Card:
         self.givenDotSpacingMult = givenDotSpacingMult
 
     @classmethod
-    def generateImage(cls, cardData: list, symbolCount: int, outDimension: int=4096, dotSpacingMult: int=128, enableDebugPrint: Boolean|int=False, tqdmBar: tqdm|dummyTqdm=dummyTqdm()):
+    def generateImage(cls, cardData: list, symbolCount: int, outDimension: int=4096, dotSpacingMult: int=128, enableDebugPrint: bool|int=False, tqdmBar: "tqdm.tqdm|dummyTqdm"=dummyTqdm()):
         abspath = os.path.abspath(__file__)
         dname = os.path.dirname(abspath)
         CARD_DATA = [
@@ -63,83 +79,39 @@ class Card:
         TMP_SEED = hash(tuple(map(lambda x:x[0], CARD_DATA))) % (2**32)
         np.random.seed(TMP_SEED)
 
-        def dotDistance(a: np.array, b: np.array) -> float:
-            return np.linalg.norm(a - b)
-        def checkDotInCircle(dot: np.array, center: np.array, radius: float) -> bool:
-            return dotDistance(dot, center) < radius
-        def countDotsInCircle(dots: np.array, center: np.array, radius: float) -> int:
-            count = 0
-            for i in dots:
-                count += checkDotInCircle(i, center, radius)
-            return count
-        def normalizePoints(data):
-            return (data - np.min(data)) / (np.max(data) - np.min(data))
-        tqdmBar.update(0.1)
-
-        disks = sorted(list(pd.Bridson_sampling(
-            radius = dotSpacingMult/OUT_DIMENSION,
-            k = 100
-        )), key=lambda x: dotDistance(x, (0.5, 0.5)))
-        tqdmBar.update(0.2)
-
-        circleSize = 128/OUT_DIMENSION
-        circleIncreaseInterval = 128/(OUT_DIMENSION*2)
-
-        while countDotsInCircle(disks, np.array([0.5, 0.5]), circleSize) < REQUIRED_DOTS:
-            circleSize += circleIncreaseInterval
-
-        while countDotsInCircle(disks, np.array([0.5, 0.5]), circleSize) > REQUIRED_DOTS:
-            circleSize -= circleIncreaseInterval/8
-
-        circleSize += circleIncreaseInterval/8
-
-        goodDisks = []
-        almostGoodDisks = []
-        badDisks = []
-        for i in disks:
-            if checkDotInCircle(i, np.array([0.5, 0.5]), circleSize):
-                if len(goodDisks) < REQUIRED_DOTS:
-                    goodDisks.append(i)
-                else:
-                    almostGoodDisks.append(i)
-            else:
-                badDisks.append(i)
         tqdmBar.update(0.1)
 
-        fg_im = Image.new('RGBA', (OUT_DIMENSION+10, OUT_DIMENSION+10), (0, 0, 0, 0))
-        normalGoodDisks = sorted(list(normalizePoints(goodDisks)), key=lambda x: dotDistance(x, (0.5, 0.5))) # Ensure sorted by distance(they should be but i want to be sure for reproducibility)
-        idealDiskSize = min(map(
-            lambda x:dotDistance(x[0], x[1]),
-            combinations(normalGoodDisks, 2),
-        ))*(OUT_DIMENSION/2)/2
+        layoutData = layout.libraryLayout(REQUIRED_DOTS, OUT_DIMENSION, dotSpacingMult, TMP_SEED)
+        if layoutData is None: # No precomputed layouts for this card shape, sample one now
+            layoutData = layout.sampleLayout(REQUIRED_DOTS, OUT_DIMENSION, dotSpacingMult, enableDebugPrint)
+        normalGoodDisks, idealDiskSize, cropCircle = layoutData
+        tqdmBar.update(0.3)
 
-        if (enableDebugPrint): print(f"Generated {len(disks)} dots and {len(goodDisks)+len(almostGoodDisks)}/{REQUIRED_DOTS} are in the circle with {len(almostGoodDisks)} pruned from the edge.")
+        # Everything is placed straight onto the output canvas, the old full size fg canvas crop+resize is worked out per symbol instead
+        canvasCircleInnerDiam = (OUT_DIMENSION-int(128/4096*OUT_DIMENSION))
+        canvasCircleCorrectedDiam = int(canvasCircleInnerDiam-int(128/4096*OUT_DIMENSION)/2)
+        cropRadius = cropCircle[2]+(idealDiskSize*2-32)
+        cardScale = canvasCircleCorrectedDiam/(cropRadius*2)
+        if (enableDebugPrint): print(cropCircle)
 
         COLORS = [
             tuple(int(i) for i in colorsys.hsv_to_rgb(i/RAINBOW_SIZE*360, .5, 1)*np.array([255, 255, 255])) for i in range(RAINBOW_SIZE)
         ]
         tqdmBar.update(0.1)
 
-        def recolorImage(im: Image.Image, color: tuple):
-            im = im.convert('RGBA')
-            data = np.array(im)
-            red, green, blue, alpha = data.T
-            black_areas = (alpha != 0)
-            data[..., :-1][black_areas.T] = color
-            im = Image.fromarray(data)
-            return im
-
         def importSvg(id: int):
-            with BytesIO() as f:
-                csvg.svg2png(url=os.path.join(dname, f"symbols/{id}.svg"), write_to=f, output_height=idealDiskSize*4)
-                im = Image.open(f)
-                im = im.crop(im.getbbox())
-                im = im.rotate(np.random.randint(0, 359), Image.BICUBIC, expand=True)
-                tmpSize = max(64, np.random.randint(idealDiskSize/2+32, idealDiskSize*2-32))
-                im = im.resize((tmpSize, tmpSize), Image.LANCZOS)
-                im = recolorImage(im, COLORS[id%len(COLORS)])
-                if (enableDebugPrint): print(f"Imported {id} with color {COLORS[id%len(COLORS)]}")
-                return im
+            color = COLORS[id%len(COLORS)]
+            im = symbol_mips.loadMip(os.path.join(dname, "symbols"), id, idealDiskSize*4)
+            if im is None: # No pyramid for this symbol yet, rasterize it the slow way
+                with BytesIO() as f:
+                    csvg.svg2png(url=os.path.join(dname, f"symbols/{id}.svg"), write_to=f, output_height=idealDiskSize*4)
+                    im = Image.open(f)
+                    im = symbol_mips.fillColor(im.crop(im.getbbox()), color)
+            im = im.rotate(np.random.randint(0, 359), Image.BICUBIC, expand=True, fillcolor=(*color, 0))
+            tmpSize = max(64, np.random.randint(idealDiskSize/2+32, idealDiskSize*2-32))
+            im = im.resize((max(1, round(tmpSize*cardScale)),)*2, Image.LANCZOS)
+            if (enableDebugPrint): print(f"Imported {id} with color {color}")
+            return im
 
         CARD_IMAGES = {
             j: [importSvg(i), tqdmBar.update(0.3/len(CARD_DATA))][0] for i,j in CARD_DATA
@@ -147,59 +119,34 @@ class Card:
 
         cardIconPositions = [
             (
-                int(disk[0]*(OUT_DIMENSION/2)+((OUT_DIMENSION/2)/2)-idealDiskSize),
-                int(disk[1]*(OUT_DIMENSION/2)+((OUT_DIMENSION/2)/2)-idealDiskSize)
-            ) for disk in normalGoodDisks
+                (pos[0]-(cropCircle[0]-cropRadius))*cardScale,
+                (pos[1]-(cropCircle[1]-cropRadius))*cardScale
+            ) for pos in layout.iconPositions(normalGoodDisks, idealDiskSize, OUT_DIMENSION)
         ]
-
-        #draw.ellipse((2048-(circleSize*2048+1024)-64, 2048-(circleSize*2048+1024)-64, 2048+(circleSize*2048+1024)+64, 2048+(circleSize*2048+1024)+64), outline=(128, 128, 128), fill=(64, 64, 64), width=16)
-        for pos, image in zip(cardIconPositions, map(lambda x:x[1], CARD_DATA)):
-            #draw.ellipse((disk[0]*2048+1024-idealDiskSize, disk[1]*2048+1024-idealDiskSize, disk[0]*2048+1024+idealDiskSize, disk[1]*2048+1024+idealDiskSize), fill=(0, 128, 0))
-            fg_im.paste(CARD_IMAGES[image], pos, CARD_IMAGES[image])
-        #for disk in almostGoodDisks:
-        #    draw.ellipse((disk[0]*2048+1024-idealDiskSize, disk[1]*2048+1024-idealDiskSize, disk[0]*2048+1024+idealDiskSize, disk[1]*2048+1024+idealDiskSize), fill=(256, 256, 0, 255))
-        #for disk in badDisks:
-        #    draw.ellipse((disk[0]*2048+1024-idealDiskSize, disk[1]*2048+1024-idealDiskSize, disk[0]*2048+1024+idealDiskSize, disk[1]*2048+1024+idealDiskSize), fill=(128, 0, 0, 255))
-        cropCircle = sec.make_circle(cardIconPositions)
-        if (enableDebugPrint): print(cropCircle)
+        iconBoxes = [
+            CARD_IMAGES[image].getchannel("A").getbbox() or (0, 0, 0, 0) for image in map(lambda x:x[1], CARD_DATA)
+        ]
+        usedBox = (
+            min(pos[0]+box[0] for pos, box in zip(cardIconPositions, iconBoxes)),
+            min(pos[1]+box[1] for pos, box in zip(cardIconPositions, iconBoxes)),
+            max(pos[0]+box[2] for pos, box in zip(cardIconPositions, iconBoxes)),
+            max(pos[1]+box[3] for pos, box in zip(cardIconPositions, iconBoxes))
+        )
+        centerOffset = ( # Same centering the old bbox crop + paste did
+            (OUT_DIMENSION-int(usedBox[2]-usedBox[0]))//2-usedBox[0],
+            (OUT_DIMENSION-int(usedBox[3]-usedBox[1]))//2-usedBox[1]
+        )
         tqdmBar.update(0.15)
 
-        canvasCircleInnerDiam = (OUT_DIMENSION-int(128/4096*OUT_DIMENSION))
-        canvasCircleCorrectedDiam = int(canvasCircleInnerDiam-int(128/4096*OUT_DIMENSION)/2)
-        #circleInsideSize = int(canvasCircleInnerRadius*np.sqrt(2)) # Diameter not radius
+        bg_im = cardBackground(OUT_DIMENSION)
+        fg_im = Image.new('RGBA', (OUT_DIMENSION, OUT_DIMENSION), (0, 0, 0, 0))
+        tqdmBar.update(0.05)
 
-        fg_im = fg_im.crop(
-            (
-                cropCircle[0]-(cropCircle[2]+(idealDiskSize*2-32)),
-                cropCircle[1]-(cropCircle[2]+(idealDiskSize*2-32)),
-                cropCircle[0]+(cropCircle[2]+(idealDiskSize*2-32)),
-                cropCircle[1]+(cropCircle[2]+(idealDiskSize*2-32))
-            )
-        ).resize(
-            (canvasCircleCorrectedDiam, canvasCircleCorrectedDiam),
-            Image.LANCZOS
-        )
-        fg_im = fg_im.crop(
-            fg_im.getbbox()
-        )
-        #fg_im_square_canvas = Image.new('RGBA', (max(fg_im.size), max(fg_im.size)), (0, 0, 0, 0))
-        #fg_im_square_canvas.paste(fg_im, ((max(fg_im.size)-fg_im.size[0])//2, (max(fg_im.size)-fg_im.size[1])//2))
-        #fg_im_square_canvas = fg_im_square_canvas.resize((circleInsideSize, circleInsideSize), Image.LANCZOS)
-        finished_fg = Image.new('RGBA', (OUT_DIMENSION, OUT_DIMENSION), (0, 0, 0, 0))
-        finished_fg.paste(fg_im, ((OUT_DIMENSION-fg_im.size[0])//2, (OUT_DIMENSION-fg_im.size[1])//2))
-        #finished_fg.paste(fg_im_square_canvas, ((OUT_DIMENSION-circleInsideSize)//2, (OUT_DIMENSION-circleInsideSize)//2))
-        #finished_fg = visual_center.visuallyCenter(finished_fg, (40, 42, 54))
-        tqdmBar.update(0.05/3)
-
-        bg_im = Image.new('RGBA', (OUT_DIMENSION, OUT_DIMENSION), (0, 0, 0, 0))
-        bg_draw = ImageDraw.Draw(bg_im)
-        bg_draw.ellipse((0, 0, OUT_DIMENSION, OUT_DIMENSION), fill=(40, 42, 54), outline=(30, 32, 44), width=int((128/4096*OUT_DIMENSION)/2))
-        tqdmBar.update(0.05/3)
-
-        fullImage = Image.new('RGBA', (OUT_DIMENSION, OUT_DIMENSION), (0, 0, 0, 0))
-        fullImage.paste(bg_im, (0, 0))
-        fullImage.paste(finished_fg, (0, 0), mask=finished_fg)
-        tqdmBar.update(0.05/3)
+        for pos, image in zip(cardIconPositions, map(lambda x:x[1], CARD_DATA)):
+            pasteOver(fg_im, CARD_IMAGES[image], (round(pos[0]+centerOffset[0]), round(pos[1]+centerOffset[1])))
+        fullImage = bg_im
+        fullImage.alpha_composite(fg_im) # In place, "over" is associative so this matches pasting every symbol onto the background up to rounding
+        tqdmBar.update(0.05)
 
         return Card(
             CARD_DATA,
@@ -207,7 +154,7 @@ class Card:
             SYMBOL_COUNT,
             (OUT_DIMENSION, OUT_DIMENSION),
             fullImage,
-            finished_fg,
-            bg_im,
+            fg_im,
+            cachedCardBackground(OUT_DIMENSION), # The copy became the card, this is the shared one so don't draw on it
             dotSpacingMult
         )
@@ -0,0 +1,55 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Precomputes card layouts so gen_image never has to run Bridson sampling online
+# Run from the server directory: python -m generator.gen_layout_library --symbols 6 28 --dimensions 2048 4096
+
+from . import startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+from . import layout
+import argparse
+import os
+import numpy as np
+from tqdm import tqdm
+
+def genLibrary(requiredDots: int, outDimension: int, dotSpacingMult: int, count: int, candidates: int) -> dict:
+    # Sample more layouts than we keep and keep the ones with the most room for each symbol
+    samples = []
+    for seed in tqdm(range(candidates), unit="layout(s)", desc=f"{requiredDots} symbols @ {outDimension}px", leave=False):
+        np.random.seed(seed)
+        samples.append(layout.sampleLayout(requiredDots, outDimension, dotSpacingMult))
+    samples = sorted(samples, key=lambda x: x[1], reverse=True)[:count]
+    return {
+        "points": np.array([i[0] for i in samples]),
+        "idealDiskSize": np.array([i[1] for i in samples]),
+        "circle": np.array([i[2] for i in samples]),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the layout library used by gen_image")
+    parser.add_argument("--symbols", type=int, nargs="+", required=True, help="Symbols per card (grid size + 1)")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[2048, 4096], help="Card output dimensions")
+    parser.add_argument("--spacing", type=int, nargs="+", default=[128], help="dotSpacingMult values")
+    parser.add_argument("--count", type=int, default=256, help="Layouts kept per key")
+    parser.add_argument("--candidates", type=int, default=1024, help="Layouts sampled per key before keeping the best")
+    args = parser.parse_args()
+
+    os.makedirs(layout.LIBRARY_DIR, exist_ok=True)
+    for requiredDots in args.symbols:
+        for outDimension in args.dimensions:
+            for dotSpacingMult in args.spacing:
+                library = genLibrary(requiredDots, outDimension, dotSpacingMult, args.count, max(args.count, args.candidates))
+                path = layout.libraryPath(requiredDots, outDimension, dotSpacingMult)
+                np.savez_compressed(path, **library)
+                print(f"Wrote {len(library['points'])} layouts to {path}")
+    print("Done!")
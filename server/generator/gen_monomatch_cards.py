@@ -9,23 +9,95 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
 from . import gen_monomatch_data
 from . import gen_image
+from . import deck_file
+import hashlib
+import json
 import os, shutil
+import argparse
+import multiprocessing as mp
 from tqdm import tqdm
 import warnings
 
 warnings.filterwarnings("ignore", module="tqdm")
 
+MANIFEST_NAME = "manifest.json" # What the cards in an output directory were rendered from, resuming needs it to match
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATIONS_DIR = os.path.join(SERVER_DIR, "card_generations") # Same paths as cardGenerations.py
+CURRENT_LINK = os.path.join(SERVER_DIR, "cards")
+
+def servedPath(outDir: str) -> bool:
+    # `cards` is a symlink into card_generations, writing there would change cards the web server is already serving
+    generations = os.path.realpath(GENERATIONS_DIR)
+    outPath = os.path.realpath(outDir)
+    return (
+        os.path.islink(outDir) or outPath == os.path.realpath(CURRENT_LINK)
+        or os.path.commonpath([outPath, generations]) == generations
+    )
+
+def cardPath(outDir: str, num: int) -> str:
+    return os.path.join(outDir, f"{num}.png")
+
+def renderCard(job: tuple) -> int:
+    # Runs in a worker, every card is seeded from its own symbols in generateImage so the pool gives the same images as a serial run
+    num, cardData, symbolCount, outDir = job
+    card = gen_image.Card.generateImage(cardData, symbolCount)
+    tmpPath = cardPath(outDir, num) + ".tmp"
+    card.cardImage.save(tmpPath, format="PNG")
+    os.replace(tmpPath, cardPath(outDir, num)) # Only finished cards ever show up under their real name, which is what resuming relies on
+    return num
+
+def deckManifest(data: gen_monomatch_data.CardData, dimension: int) -> dict:
+    return {
+        "dimension": dimension,
+        "deck": hashlib.sha256(json.dumps(list(data.card_data)).encode("utf-8")).hexdigest(),
+        "symbols": deck_file.symbolSetHash().hex(),
+    }
+
+def readManifest(outDir: str) -> dict|None:
+    try:
+        with open(os.path.join(outDir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 if __name__ == "__main__":
+    mp.freeze_support()
+    parser = argparse.ArgumentParser(description="Render every card of a deck")
+    parser.add_argument("--dimension", type=int, default=5, help="Deck dimension passed to generateCardDataByDimension")
+    parser.add_argument("--out", default="deck_cards", help="Output directory, must not be the served cards or anything in card_generations")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes, defaults to every core")
+    parser.add_argument("--fresh", action="store_true", help="Delete previous output instead of resuming it, resuming only happens when it came from the same deck and symbols anyway")
+    args = parser.parse_args()
+    if servedPath(args.out):
+        parser.error(f"{args.out} is a symlink, the served cards or inside {GENERATIONS_DIR}, pick a directory the web server doesn't serve from")
+
     print("Generating cards...")
-    data = gen_monomatch_data.CardData.generateCardDataByDimension(5)
+    data = gen_monomatch_data.CardData.generateCardDataByDimension(args.dimension)
     print("Generating images...")
-    shutil.rmtree("cards", ignore_errors=True)
-    os.mkdir("cards")
-    cardBar = tqdm(total=1, unit="step(s)", desc=f"Generating card", position=1, unit_scale=True)
-    for num,i in tqdm(enumerate(data.card_data), total=len(data.card_data), unit="card(s)", desc="Generating cards", position=0):
-        cardBar.reset()
-        card = gen_image.Card.generateImage(i, data.symbol_count, tqdmBar=cardBar)
-        card.cardImage.save(f"./cards/{num}.png")
+    manifest = deckManifest(data, args.dimension)
+    if not args.fresh and os.path.isdir(args.out) and readManifest(args.out) != manifest:
+        print(f"{args.out} was rendered from a different deck, dimension or symbol set, starting over")
+        args.fresh = True
+    if args.fresh:
+        if os.path.exists(args.out):
+            shutil.rmtree(args.out)
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+
+    jobs = [
+        (num, i, data.symbol_count, args.out) for num,i in enumerate(data.card_data) if not os.path.isfile(cardPath(args.out, num))
+    ]
+    if len(jobs) != len(data.card_data):
+        print(f"Resuming, {len(data.card_data)-len(jobs)}/{len(data.card_data)} cards already rendered")
+
+    with mp.Pool(processes=args.processes) as pool, tqdm(total=len(data.card_data), initial=len(data.card_data)-len(jobs), unit="card(s)", desc="Generating cards") as cardBar:
+        for num in pool.imap_unordered(renderCard, jobs):
+            cardBar.update(1)
     print("Done!")
@@ -13,17 +13,77 @@ if __name__ == "__main__":
     print("This is a library. It should not be run directly.")
     exit(1)
 
+from functools import lru_cache
 from math import sqrt
 from typing import Any
-import sympy
+import numpy as np
 from datetime import datetime
 
+@lru_cache(maxsize=8)
+def slopeInverses(gridSize: int) -> np.ndarray:
+    # x -> x^-1 mod gridSize, gridSize is prime so every slope difference is invertible
+    inverses = np.array([0] + [pow(x, -1, gridSize) for x in range(1, gridSize)], dtype=np.int64)
+    inverses.flags.writeable = False # Shared by every caller through the cache
+    return inverses
+
+class CardRows:
+    # Read only view over the card array that hands out plain lists, so code written against the old list of lists keeps working
+    def __init__(self, cards: np.ndarray):
+        self.cards = cards
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def __getitem__(self, index) -> list:
+        return self.cards[index].tolist()
+
+    def __iter__(self):
+        for i in range(len(self.cards)):
+            yield self.cards[i].tolist()
+
+class LazyCardRows:
+    # Same interface as CardRows but every card is worked out from its index, nothing is stored
+    def __init__(self, grid_size: int):
+        self.grid_size = grid_size
+
+    def __len__(self) -> int:
+        return self.grid_size * self.grid_size + self.grid_size + 1
+
+    def __getitem__(self, index) -> list:
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("card index out of range")
+        return CardData.cardSymbols(self.grid_size, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield CardData.cardSymbols(self.grid_size, i)
+
 class CardData:
-    def __init__(self, symbol_count, card_count, card_data, grid_size):
+    def __init__(self, symbol_count, card_count, card_data, grid_size, symbol_cards=None, source_path=None):
+        # card_data=None gives a lazy deck that computes cards on demand
+        # source_path is set when the arrays are mapped from a deck file, see deck_file.py
         self.symbol_count = symbol_count
         self.card_count = card_count
-        self.card_data = card_data
         self.grid_size = grid_size
+        self.source_path = source_path
+        if card_data is None:
+            self.cards = None
+            self.card_data = LazyCardRows(grid_size)
+            self.symbol_cards = None
+        else:
+            self.cards = np.ascontiguousarray(card_data) # (card_count, grid_size+1), int16 unless the deck needs more
+            self.card_data = CardRows(self.cards)
+            self.symbol_cards = self.genSymbolIndex(self.cards, symbol_count) if symbol_cards is None else symbol_cards
+
+    def __reduce__(self):
+        # A mapped deck is sent to other processes as its path so they map the same pages instead of unpickling a copy
+        if self.source_path is not None:
+            from .deck_file import loadCardData
+            return (loadCardData, (self.source_path,))
+        return (CardData, (self.symbol_count, self.card_count, self.cards, self.grid_size, self.symbol_cards))
 
     def __getitem__(self, name: str) -> Any:
         if   name == "symbol_count": return self.symbol_count
@@ -31,17 +91,99 @@ class CardData:
         elif name == "card_data":    return self.card_data
         elif name == "grid_size":    return self.grid_size
 
+    @staticmethod
+    def genSymbolIndex(cards: np.ndarray, symbolCount: int) -> np.ndarray:
+        # symbol -> the cards it appears on, every symbol is on exactly grid_size+1 cards in a projective plane
+        order = np.argsort(cards.ravel(), kind="stable")
+        return (order // cards.shape[1]).astype(cards.dtype).reshape(symbolCount, -1)
+
+    def cardsWithSymbol(self, symbol: int) -> list:
+        if self.symbol_cards is None:
+            return self.symbolCards(self.grid_size, int(symbol))
+        return self.symbol_cards[symbol].tolist()
+
+    def shared_symbol(self, a: int, b: int) -> int:
+        return int(self.shared_symbols(np.array([a]), np.array([b]))[0])
+
+    def shared_symbols(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # The one symbol each pair of cards has in common, worked out from the indices alone
+        # The first N*N cards are the lines y = i*x + j, the next N are the vertical lines x = c and the last is the line at infinity
+        # Indices come from user submitted answers, so anything out of range or a card paired with itself is a ValueError
+        N = self.grid_size
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        for cards in (a, b):
+            invalid = (cards < 0) | (cards >= self.card_count)
+            if invalid.any():
+                raise ValueError(f"Card {cards[invalid].flat[0]} is out of range, the deck has {self.card_count} cards")
+        same = a == b
+        if same.any():
+            raise ValueError(f"Card {a[same].flat[0]} was compared with itself, it has no single shared symbol")
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        i1, j1 = np.divmod(np.minimum(lo, N * N - 1), N)
+        i2, j2 = np.divmod(np.minimum(hi, N * N - 1), N)
+        k = ((j2 - j1) * slopeInverses(N)[(i1 - i2) % N]) % N # Where two lines with different slopes cross
+        c = hi - N * N # Column of a vertical line
+        loLine, hiLine = lo < N * N, hi < N * N
+        hiVertical = (hi >= N * N) & (hi < N * N + N)
+        return np.select(
+            [
+                loLine & hiLine & (i1 == i2),
+                loLine & hiLine,
+                loLine & hiVertical,
+                loLine,
+            ],
+            [
+                N * N + i1,                  # Parallel lines meet at their slope's point at infinity
+                ((i1 * k + j1) % N) * N + k,
+                ((i1 * c + j1) % N) * N + c,
+                N * N + i1,                  # A line and the line at infinity
+            ],
+            N * N + N                        # Vertical lines meet each other and the line at infinity at the same point
+        )
+
+    @staticmethod
+    def cardSymbols(gridSize: int, index: int) -> list:
+        # Card `index` straight from the pseudocode below in O(grid_size), matches generateCardDataByDimension row for row
+        N = gridSize
+        if index < N * N:
+            i, j = divmod(index, N)
+            return [((i * k + j) % N) * N + k for k in range(N)] + [N * N + i]
+        elif index < N * N + N:
+            i = index - N * N
+            return [j * N + i for j in range(N)] + [N * N + N]
+        return [N * N + i for i in range(N+1)]
+
+    @staticmethod
+    def symbolCards(gridSize: int, symbol: int) -> list:
+        # Inverse of cardSymbols, the grid_size+1 cards a symbol appears on in ascending order
+        N = gridSize
+        if symbol < N * N:
+            row, k = divmod(symbol, N)
+            return sorted(i * N + (row - i * k) % N for i in range(N)) + [N * N + k]
+        elif symbol < N * N + N:
+            i = symbol - N * N
+            return [i * N + j for j in range(N)] + [N * N + N]
+        return [N * N + i for i in range(N+1)]
 
     @classmethod
-    def generateCardDataByCards(cls, targetCards: int):
+    def generateCardDataByCards(cls, targetCards: int, lazy: bool=False):
+        import sympy # Only needed to build a deck, deck files skip it entirely
         TARGET_CARDS = targetCards
         prevPrime = sympy.ntheory.generate.prevprime(sqrt(TARGET_CARDS))
         nextPrime = sympy.ntheory.generate.nextprime(sqrt(TARGET_CARDS))
         GRID_SIZE = min([[prevPrime**2+prevPrime, prevPrime], [nextPrime**2+nextPrime, nextPrime]], key=lambda x:abs(x[0]-TARGET_CARDS))[1]
-        return cls.generateCardDataByDimension(GRID_SIZE)
+        return cls.generateCardDataByDimension(GRID_SIZE, lazy)
+
+    @classmethod
+    def generateCardDataBySymbolCount(cls, symbolCount: int, lazy: bool=False):
+        # The symbol count has been consistently following approximately this pattern
+        import sympy
+        return cls.generateCardDataByDimension(sympy.ntheory.generate.prevprime(sqrt(symbolCount-sqrt(symbolCount)-1)), lazy)
 
     @classmethod
-    def generateCardDataByDimension(cls, targetDimension: int):
+    def generateCardDataByDimension(cls, targetDimension: int, lazy: bool=False):
+        import sympy
         GRID_SIZE = targetDimension
         if not sympy.isprime(GRID_SIZE):
             prevPrime = sympy.ntheory.generate.prevprime(sqrt(GRID_SIZE))
@@ -51,6 +193,14 @@ class CardData:
         print(f"Grid size: {GRID_SIZE}x{GRID_SIZE}")
         print(f"Card count: {GRID_SIZE**2+GRID_SIZE+1}")
 
+        if lazy:
+            return CardData(
+                symbol_count = GRID_SIZE * GRID_SIZE + GRID_SIZE + 1,
+                card_count = GRID_SIZE * GRID_SIZE + GRID_SIZE + 1,
+                grid_size = GRID_SIZE,
+                card_data = None
+            )
+
         # Pseudocode for generating monomatch:
         # // N*N first cards
         # for I = 0 to N-1
@@ -78,29 +228,22 @@ class CardData:
         # end for
 
         print("Generating cards...")
-        cards = []
         maxSymbols = GRID_SIZE * GRID_SIZE + GRID_SIZE + 1
-        cardBuf = []
-
-        for i in range(GRID_SIZE):
-            for j in range(GRID_SIZE):
-                for k in range(GRID_SIZE):
-                    cardBuf.append( ((i * k + j) % GRID_SIZE) * GRID_SIZE + k )
-                cardBuf.append(GRID_SIZE * GRID_SIZE + i)
-                cards.append(cardBuf)
-                cardBuf = []
-
-        for i in range(GRID_SIZE):
-            for j in range(GRID_SIZE):
-                cardBuf.append(j * GRID_SIZE + i)
-            cardBuf.append(GRID_SIZE * GRID_SIZE + GRID_SIZE)
-            cards.append(cardBuf)
-            cardBuf = []
-
-        for i in range(GRID_SIZE+1):
-            cardBuf.append(GRID_SIZE * GRID_SIZE + i)
-        cards.append(cardBuf)
-        cardBuf = []
+        dtype = np.int16 if maxSymbols <= np.iinfo(np.int16).max else np.int32
+        i = np.arange(GRID_SIZE, dtype=np.int64)
+
+        # Same three blocks as the pseudocode, just built as whole arrays instead of one symbol at a time
+        firstCards = ((i[:, None, None] * i[None, None, :] + i[None, :, None]) % GRID_SIZE) * GRID_SIZE + i[None, None, :]
+        firstCards = np.concatenate([
+            firstCards.reshape(GRID_SIZE*GRID_SIZE, GRID_SIZE),
+            np.repeat(GRID_SIZE * GRID_SIZE + i, GRID_SIZE)[:, None]
+        ], axis=1)
+        nextCards = np.concatenate([
+            i[None, :] * GRID_SIZE + i[:, None],
+            np.full((GRID_SIZE, 1), GRID_SIZE * GRID_SIZE + GRID_SIZE)
+        ], axis=1)
+        lastCard = (GRID_SIZE * GRID_SIZE + np.arange(GRID_SIZE+1))[None, :]
+        cards = np.ascontiguousarray(np.concatenate([firstCards, nextCards, lastCard]).astype(dtype))
 
         print(f"Generated {len(cards)} cards using {maxSymbols} symbols at {len(cards[0])} symbols per card\nGenerating dict to write...")
         cardData = CardData (
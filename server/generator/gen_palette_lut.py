@@ -0,0 +1,30 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds the nearest colour table palette.quantizeCard looks cards up in, so no render ever pays for the KD tree
+# Run from the server directory after changing the palette: python -m generator.gen_palette_lut
+
+from . import startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+from . import palette
+import glob
+import os
+import numpy as np
+
+if __name__ == "__main__":
+    path = palette.lutPath()
+    for old in glob.glob(os.path.join(palette.dname, "palette_lut_*.npy")):
+        if old != path:
+            os.remove(old) # Built from a palette that no longer exists
+    np.save(path, palette.buildOpaqueLut())
+    print(f"Wrote {path}")
@@ -0,0 +1,106 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+from functools import lru_cache
+import os
+import numpy as np
+from . import smallestenclosingcircle as sec
+from . import startup
+
+pd = startup.lazyImport("poisson_disc") # Only sampled online when the layout library misses
+spatial = startup.lazyImport("scipy.spatial")
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+CARD_CENTER = np.array([0.5, 0.5])
+LIBRARY_DIR = os.path.join(dname, "layouts")
+
+# Vectorized replacements for the per-dot helpers that used to live inside Card.generateImage.
+# Every function takes an (N, 2) array of points and never loops over them in python.
+
+def distancesTo(points: np.ndarray, center: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(np.asarray(points) - np.asarray(center), axis=1)
+
+def sortByDistance(points: np.ndarray, center: np.ndarray) -> np.ndarray:
+    points = np.asarray(points)
+    return points[np.argsort(distancesTo(points, center), kind="stable")] # Stable so ties keep the sampler's order, same as sorted() did
+
+def radiusForCount(points: np.ndarray, center: np.ndarray, count: int) -> float:
+    # Smallest radius whose circle holds `count` points, found with a partition instead of stepping the radius
+    distances = distancesTo(points, center)
+    if count <= 0:
+        return 0.0
+    if count > len(distances):
+        raise ValueError(f"Only {len(distances)} points were given but {count} are required")
+    return float(np.partition(distances, count-1)[count-1])
+
+def splitByRadius(points: np.ndarray, center: np.ndarray, count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    # Returns (good, almostGood, bad, radius): the `count` closest points, the rest that still fall inside the circle, and the points outside it
+    points = sortByDistance(points, center)
+    radius = radiusForCount(points, center, count)
+    inside = int(np.searchsorted(distancesTo(points, center), radius, side="right"))
+    return points[:count], points[count:inside], points[inside:], radius
+
+def normalizePoints(points: np.ndarray) -> np.ndarray:
+    points = np.asarray(points)
+    return (points - np.min(points)) / (np.max(points) - np.min(points))
+
+def minimumSpacing(points: np.ndarray) -> float:
+    # Nearest neighbour distance over the whole set, k=2 because each point's closest match is itself
+    points = np.asarray(points)
+    if len(points) < 2:
+        return 0.0
+    distances, _ = spatial.cKDTree(points).query(points, k=2)
+    return float(np.min(distances[:, 1]))
+
+def iconPositions(normalPoints: np.ndarray, idealDiskSize: float, outDimension: int) -> list[tuple[int, int]]:
+    return [
+        (
+            int(disk[0]*(outDimension/2)+((outDimension/2)/2)-idealDiskSize),
+            int(disk[1]*(outDimension/2)+((outDimension/2)/2)-idealDiskSize)
+        ) for disk in normalPoints
+    ]
+
+def sampleLayout(requiredDots: int, outDimension: int, dotSpacingMult: int, enableDebugPrint: bool|int=False) -> tuple[np.ndarray, float, tuple]:
+    # Returns (normalized points, idealDiskSize, enclosing circle of the icon positions), uses the global numpy rng like it always has
+    disks = sortByDistance(pd.Bridson_sampling(
+        radius = dotSpacingMult/outDimension,
+        k = 100
+    ), CARD_CENTER)
+    goodDisks, almostGoodDisks, badDisks, circleSize = splitByRadius(disks, CARD_CENTER, requiredDots)
+    normalGoodDisks = sortByDistance(normalizePoints(goodDisks), CARD_CENTER) # Ensure sorted by distance(they should be but i want to be sure for reproducibility)
+    idealDiskSize = minimumSpacing(normalGoodDisks)*(outDimension/2)/2
+    if (enableDebugPrint): print(f"Generated {len(disks)} dots and {len(goodDisks)+len(almostGoodDisks)}/{requiredDots} are in the circle with {len(almostGoodDisks)} pruned from the edge.")
+    return normalGoodDisks, idealDiskSize, sec.make_circle(iconPositions(normalGoodDisks, idealDiskSize, outDimension))
+
+def libraryPath(requiredDots: int, outDimension: int, dotSpacingMult: int) -> str:
+    return os.path.join(LIBRARY_DIR, f"{requiredDots}_{outDimension}_{dotSpacingMult}.npz")
+
+@lru_cache(maxsize=None)
+def loadLibrary(requiredDots: int, outDimension: int, dotSpacingMult: int) -> dict|None:
+    path = libraryPath(requiredDots, outDimension, dotSpacingMult)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as library:
+        return {key: library[key] for key in library.files}
+
+def libraryLayout(requiredDots: int, outDimension: int, dotSpacingMult: int, seed: int) -> tuple[np.ndarray, float, tuple]|None:
+    # Same return shape as sampleLayout, None when gen_layout_library hasn't been run for this card shape
+    library = loadLibrary(requiredDots, outDimension, dotSpacingMult)
+    if library is None:
+        return None
+    i = seed % len(library["points"])
+    return library["points"][i], float(library["idealDiskSize"][i]), tuple(library["circle"][i])
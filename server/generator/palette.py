@@ -0,0 +1,116 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Fixed palette for finished cards, replaces running median cut on every card
+# Every colour on a card is known ahead of time: the symbol rainbow blended over the background at some alpha,
+# the background and outline, and the outline fading into transparency at the disk edge
+
+from functools import lru_cache
+import colorsys
+import hashlib
+import os
+import numpy as np
+from PIL import Image
+from . import startup
+
+spatial = startup.lazyImport("scipy.spatial") # Only used to build the lookup table, gen_palette_lut ships it prebuilt
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+RAINBOW_SIZE = 128
+BG_COLOR = (40, 42, 54)
+OUTLINE_COLOR = (30, 32, 44)
+SYMBOL_BLEND_LEVELS = 15
+LUT_BITS = 6
+KEY_MASK = ((1 << LUT_BITS) - 1) * 0x010101 # Top LUT_BITS of r, g and b once a little endian RGBA pixel is shifted down by 8-LUT_BITS
+QUANTIZE_CHUNK = 1 << 16 # Pixels per lookup pass, keeps the intp keys np.take needs in cache
+
+# The rainbow only has 16 distinct colours once rounded, dedupe them so the blends fit in 256 entries
+SYMBOL_COLORS = list(dict.fromkeys(
+    tuple(int(i) for i in colorsys.hsv_to_rgb(i/RAINBOW_SIZE*360, .5, 1)*np.array([255, 255, 255])) for i in range(RAINBOW_SIZE)
+))
+
+def genPalette() -> np.ndarray:
+    # Index 0 is transparent, then opaque background/outline/symbol blends, then the outline's edge alphas fill the rest
+    palette = [(0, 0, 0, 0), (*BG_COLOR, 255), (*OUTLINE_COLOR, 255)]
+    for color in SYMBOL_COLORS:
+        for level in range(1, SYMBOL_BLEND_LEVELS+1):
+            a = level/SYMBOL_BLEND_LEVELS
+            palette.append((*(round(c*a + bg*(1-a)) for c, bg in zip(color, BG_COLOR)), 255))
+    edgeLevels = 256-len(palette)
+    for level in range(1, edgeLevels+1):
+        palette.append((*OUTLINE_COLOR, round(255*level/(edgeLevels+1))))
+    return np.array(palette, dtype=np.uint8)
+
+CARD_PALETTE = genPalette()
+OPAQUE_INDICES = np.flatnonzero(CARD_PALETTE[:, 3] == 255)
+EDGE_INDICES = np.flatnonzero(CARD_PALETTE[:, 3] != 255) # Includes the transparent entry
+
+def lutPath() -> str:
+    # Named after what it was built from so a changed palette never loads a stale table
+    digest = hashlib.sha256(CARD_PALETTE.tobytes() + bytes([LUT_BITS])).hexdigest()[:12]
+    return os.path.join(dname, f"palette_lut_{digest}.npy")
+
+def buildOpaqueLut() -> np.ndarray:
+    # Nearest opaque palette entry for every RGB bucket, indexed r | g << LUT_BITS | b << 2*LUT_BITS
+    step = 1 << (8-LUT_BITS)
+    centers = np.arange(0, 256, step) + step//2
+    b, g, r = np.meshgrid(centers, centers, centers, indexing="ij")
+    buckets = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+    _, nearest = spatial.cKDTree(CARD_PALETTE[OPAQUE_INDICES, :3].astype(np.float64)).query(buckets)
+    return OPAQUE_INDICES[nearest].astype(np.uint8)
+
+@lru_cache(maxsize=None)
+def opaqueLut() -> np.ndarray:
+    # Spread out so a bucket's index is just the top LUT_BITS of each byte of a little endian RGBA pixel,
+    # the key is then one shift and one mask of the uint32 view
+    path = lutPath()
+    if os.path.isfile(path):
+        compact = np.load(path)
+    else:
+        print(f"No palette lookup table at {path}, building it in memory, run `python -m generator.gen_palette_lut` from the server directory to ship it")
+        compact = buildOpaqueLut()
+    levels = np.arange(1 << LUT_BITS, dtype=np.intp)
+    b, g, r = np.meshgrid(levels, levels, levels, indexing="ij")
+    lut = np.zeros(KEY_MASK+1, dtype=np.uint8)
+    lut[(r | g << 8 | b << 16).ravel()] = compact
+    return lut
+
+@lru_cache(maxsize=None)
+def edgeLut() -> np.ndarray:
+    # Nearest translucent palette entry for every alpha, only the disk edge and the corners land here
+    edgeAlphas = CARD_PALETTE[EDGE_INDICES, 3].astype(np.int16)
+    return EDGE_INDICES[np.argmin(np.abs(np.arange(256, dtype=np.int16)[:, None] - edgeAlphas[None, :]), axis=1)].astype(np.uint8)
+
+def quantizeCard(im: Image.Image) -> Image.Image:
+    im = im if im.mode == "RGBA" else im.convert("RGBA")
+    data = np.asarray(im)
+    pixels = data.view("<u4").ravel()
+    indices = np.empty(pixels.shape, dtype=np.uint8)
+    opaque = opaqueLut()
+    shift = 8-LUT_BITS
+    key = np.empty(QUANTIZE_CHUNK, dtype=np.intp)
+    for start in range(0, len(pixels), QUANTIZE_CHUNK):
+        end = min(start+QUANTIZE_CHUNK, len(pixels))
+        np.right_shift(pixels[start:end], shift, out=key[:end-start], dtype=np.intp)
+        key[:end-start] &= KEY_MASK
+        np.take(opaque, key[:end-start], out=indices[start:end])
+    # Alpha only picks the entry for translucent pixels, PIL's point does that lookup in C without widening to intp
+    edgeIndices = np.asarray(im.getchannel("A").point(edgeLut().tolist())).ravel()
+    np.copyto(indices, edgeIndices, where=data[..., 3].ravel() != 255)
+    out = Image.fromarray(indices.reshape(data.shape[:2]), mode="P")
+    out.putpalette(CARD_PALETTE.tobytes(), rawmode="RGBA")
+    return out
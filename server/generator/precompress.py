@@ -0,0 +1,117 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Precompressed br/gzip variants of static assets, written next to the original as <file>.br / <file>.gz
+# Compression happens once at build time at the highest levels so the server only has to pick a variant per request.
+# A variant is only kept when it is actually smaller, so png/webp/ico never get one.
+#
+# Rebuild everything with `python -m generator.precompress` from the server directory
+
+if __name__ == "__main__":
+    import generator.startup as startup
+    startup.profileIfAsked(__file__, __spec__)
+
+import gzip
+import os
+import brotli
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+ENCODINGS = { # Preferred order when the client rates them equally
+    "br": (".br", lambda data: brotli.compress(data, quality=11, lgwin=24)),
+    "gzip": (".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+}
+FAST_LEVELS = { # For variants missing at server startup, max quality is left to the build step
+    "br": lambda data: brotli.compress(data, quality=4),
+    "gzip": lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+}
+MIN_SIZE = 256 # Below this the headers cost more than compression saves
+MIN_SAVING = 0.1 # Keep a variant only if it's at least 10% smaller
+SKIPPED_SUFFIX = ".uncompressed" # Empty marker, the build step found no variant worth keeping for this version of the file
+DEFAULT_TARGETS = [ # (folder relative to the server dir, extensions)
+    ("generator/symbols", (".svg",)),
+]
+
+def variantPath(path: str, encoding: str) -> str:
+    return path + ENCODINGS[encoding][0]
+
+def isFresh(path: str, mtime: float) -> bool:
+    return os.path.isfile(path) and os.path.getmtime(path) >= mtime
+
+def compressVariants(data: bytes, fast: bool=False) -> dict[str, bytes]:
+    if len(data) < MIN_SIZE:
+        return {}
+    variants = {}
+    for encoding, (_, compress) in ENCODINGS.items():
+        compressed = (FAST_LEVELS[encoding] if fast else compress)(data)
+        if len(compressed) <= len(data) * (1-MIN_SAVING):
+            variants[encoding] = compressed
+    return variants
+
+staleWarned = False
+
+def loadVariants(path: str, data: bytes|None=None) -> dict[str, bytes]:
+    # Variants from disk when the build step wrote them for this version of the file, otherwise compressed in memory
+    # at FAST_LEVELS so a stale or missing set can't hold up startup
+    global staleWarned
+    if (len(data) if data is not None else os.path.getsize(path)) < MIN_SIZE:
+        return {}
+    mtime = os.path.getmtime(path)
+    variants = {}
+    for encoding in ENCODINGS:
+        variant = variantPath(path, encoding)
+        if isFresh(variant, mtime):
+            with open(variant, "rb") as f:
+                variants[encoding] = f.read()
+    if len(variants) or isFresh(path + SKIPPED_SUFFIX, mtime):
+        return variants
+    if not staleWarned:
+        print(f"Precompressed variants are missing or stale (first: {path}), using fast in memory compression, run `python -m generator.precompress` from the server directory to rebuild them")
+        staleWarned = True
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    return compressVariants(data, fast=True)
+
+def precompressFile(path: str) -> dict[str, int]:
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = compressVariants(data)
+    for encoding in ENCODINGS:
+        variant = variantPath(path, encoding)
+        if encoding in variants:
+            tmpPath = f"{variant}.tmp.{os.getpid()}"
+            with open(tmpPath, "wb") as f:
+                f.write(variants[encoding])
+            os.replace(tmpPath, variant)
+        elif os.path.lexists(variant):
+            os.remove(variant) # Left over from an older, more compressible version
+    skipped = path + SKIPPED_SUFFIX
+    if len(variants) == 0 and len(data) >= MIN_SIZE:
+        open(skipped, "wb").close()
+    elif os.path.lexists(skipped):
+        os.remove(skipped)
+    return {encoding: len(data) for encoding, data in variants.items()}
+
+def precompressFolder(folder: str, extensions: tuple[str]) -> int:
+    count = 0
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(extensions):
+            precompressFile(os.path.join(folder, name))
+            count += 1
+    return count
+
+if __name__ == "__main__":
+    serverDir = os.path.dirname(dname)
+    for folder, extensions in DEFAULT_TARGETS:
+        count = precompressFolder(os.path.join(serverDir, folder), extensions)
+        print(f"Precompressed {count} file(s) in {folder}")
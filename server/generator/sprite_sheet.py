@@ -0,0 +1,69 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Answer sprite sheet, every symbol on the current card pair packed into one image plus a json map of where each one is
+# Lets the answer table be one image request per viewer instead of one per symbol
+# Written into each card generation next to the cards as <name>.png, <name>.webp and <name>.json
+
+import json
+import math
+import os
+from PIL import Image
+from . import symbol_mips
+from . import encoder
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+SYMBOLS_DIR = os.path.join(dname, "symbols")
+SPRITE_CELL = 128
+SPRITE_PADDING = 4
+SPRITE_FORMATS = ("png", "webp")
+
+def loadSymbol(id: int, size: int, symbolsDir: str=SYMBOLS_DIR) -> Image.Image:
+    # Smallest mip that covers the cell, the full size png when mips haven't been generated
+    im = symbol_mips.loadMip(symbolsDir, id, size)
+    if im is None:
+        with Image.open(os.path.join(symbolsDir, "png", f"{id}.png")) as f:
+            im = f.convert("RGBA")
+    return im
+
+def packSprites(ids: list[int], cellSize: int=SPRITE_CELL, padding: int=SPRITE_PADDING, symbolsDir: str=SYMBOLS_DIR) -> tuple[Image.Image, dict]:
+    # Square-ish grid of fixed cells, each symbol scaled to fit its cell and centered
+    columns = max(1, math.ceil(math.sqrt(len(ids))))
+    rows = max(1, math.ceil(len(ids) / columns))
+    sheet = Image.new("RGBA", (columns*cellSize, rows*cellSize), (0, 0, 0, 0))
+    symbols = {}
+    for num, id in enumerate(ids):
+        im = loadSymbol(int(id), cellSize, symbolsDir)
+        im.thumbnail((cellSize-padding*2, cellSize-padding*2), Image.Resampling.LANCZOS)
+        x = num % columns * cellSize + (cellSize-im.width) // 2
+        y = num // columns * cellSize + (cellSize-im.height) // 2
+        sheet.alpha_composite(im, (x, y))
+        symbols[str(int(id))] = [x, y, im.width, im.height]
+    return sheet, {
+        "width": sheet.width,
+        "height": sheet.height,
+        "cell": cellSize,
+        "symbols": symbols, # id -> [x, y, width, height]
+    }
+
+def writeSpriteSheet(ids: list[int], outDir: str, name: str="answers", preset: str="fast") -> dict[str, str]:
+    sheet, coords = packSprites(ids)
+    paths = {format: os.path.join(outDir, f"{name}.{format}") for format in (*SPRITE_FORMATS, "json")}
+    encoder.encodeAll([(sheet, paths[format]) for format in SPRITE_FORMATS], preset=preset)
+    with open(paths["json"], "w") as f:
+        json.dump(coords, f, separators=(",", ":"))
+    return paths
@@ -0,0 +1,134 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Keeping restarts fast
+#   lazyImport       module stand-in that imports on first attribute access, for heavy modules only some code paths use
+#   profileIfAsked   first thing every entry point calls, with --profile-startup it reports import time per module
+#                    (python -X importtime in a fresh interpreter) and exits instead of starting
+#
+#   python serverMain.py --profile-startup                        slowest 25 modules
+#   python serverMain.py --profile-startup=startup.json           same, and save every module's timing
+#   python serverMain.py --profile-startup --profile-compare=startup.json   what got slower since it was saved
+#
+# Only stdlib imports in here, it runs before anything else
+
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+PROFILE_FLAG = "--profile-startup"
+COMPARE_FLAG = "--profile-compare"
+PROFILE_TOP = 25
+COMPARE_MIN_MS = 1 # Smaller changes are noise between runs
+
+class LazyModule:
+    def __init__(self, name: str):
+        self.__dict__["lazyName"] = name
+        self.__dict__["module"] = None
+
+    def __getattr__(self, attr: str):
+        module = self.__dict__["module"]
+        if module is None:
+            module = self.__dict__["module"] = importlib.import_module(self.__dict__["lazyName"])
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.__dict__['lazyName']!r}{' (loaded)' if self.__dict__['module'] is not None else ''}>"
+
+def lazyImport(name: str) -> LazyModule:
+    return sys.modules.get(name) or LazyModule(name) # Already imported costs nothing, hand out the real thing
+
+def flagValue(flag: str, argv: list[str]) -> str|None:
+    # "" for a bare flag, the value for flag=value, None when absent
+    for i in argv:
+        if i == flag:
+            return ""
+        if i.startswith(f"{flag}="):
+            return i[len(flag)+1:]
+    return None
+
+def entryModule(file: str, spec) -> tuple[str, str]:
+    # (module name, directory to import it from), `python -m generator.x` has a spec, plain scripts don't
+    path = os.path.abspath(file)
+    if spec is None or spec.name == "__main__":
+        return os.path.splitext(os.path.basename(path))[0], os.path.dirname(path)
+    root = os.path.dirname(path)
+    for _ in range(spec.name.count(".")):
+        root = os.path.dirname(root)
+    return spec.name, root
+
+def parseImportTime(output: str) -> tuple[dict[str, dict[str, float]], float]:
+    # ({module: {"self": ms, "cumulative": ms}}, total ms), total is the sum over top level imports
+    modules = {}
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        selfUs, cumulativeUs, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = {"self": int(selfUs)/1000, "cumulative": int(cumulativeUs)/1000}
+        if depth == 0:
+            total += int(cumulativeUs)/1000
+    return modules, total
+
+def profileImports(module: str, directory: str) -> tuple[dict[str, dict[str, float]], float]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=directory, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print("\n".join(i for i in result.stderr.splitlines() if not i.startswith("import time:"))) # Just the traceback
+        exit(result.returncode)
+    return parseImportTime(result.stderr)
+
+def printProfile(module: str, modules: dict, total: float):
+    print(f"Startup imports for {module}: {total:.1f}ms over {len(modules)} modules")
+    print(f"  {'cumulative ms':>14}{'self ms':>10}  module")
+    for name, times in sorted(modules.items(), key=lambda i: -i[1]["cumulative"])[:PROFILE_TOP]:
+        print(f"  {times['cumulative']:>14.1f}{times['self']:>10.1f}  {name}")
+
+def printComparison(modules: dict, total: float, baseline: dict):
+    print(f"\nAgainst baseline: {total:.1f}ms vs {baseline['total']:.1f}ms ({total-baseline['total']:+.1f}ms)")
+    changes = []
+    for name, times in modules.items():
+        old = baseline["modules"].get(name)
+        if old is None:
+            changes.append((times["self"], f"  new      {times['self']:>8.1f}ms  {name}"))
+        elif times["self"] - old["self"] >= COMPARE_MIN_MS:
+            changes.append((times["self"] - old["self"], f"  slower   {times['self']-old['self']:>+8.1f}ms  {name}"))
+    for name in baseline["modules"].keys() - modules.keys():
+        changes.append((0, f"  dropped  {baseline['modules'][name]['self']:>8.1f}ms  {name}"))
+    for _, line in sorted(changes, key=lambda i: -i[0])[:PROFILE_TOP]:
+        print(line)
+
+def profileIfAsked(file: str, spec=None, argv: list[str]=sys.argv):
+    # Call as profileIfAsked(__file__, __spec__) before the entry point's other imports
+    savePath = flagValue(PROFILE_FLAG, argv)
+    if savePath is None:
+        return
+    module, directory = entryModule(file, spec)
+    modules, total = profileImports(module, directory)
+    printProfile(module, modules, total)
+    comparePath = flagValue(COMPARE_FLAG, argv)
+    if comparePath:
+        with open(comparePath) as f:
+            printComparison(modules, total, json.load(f))
+    if savePath:
+        with open(savePath, "w") as f:
+            json.dump({"module": module, "total": total, "modules": modules}, f, indent=2)
+        print(f"Saved to {savePath}")
+    exit(0)
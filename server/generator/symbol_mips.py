@@ -0,0 +1,48 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# Pre-rasterized symbol pyramid, written by genSymbolFiles.py and read by gen_image.py
+# Layout is symbols/mip/<render height>/<id>.png, each level already cropped to its bbox and coloured
+
+import os
+import numpy as np
+from PIL import Image
+
+MIP_SIZES = [2**i for i in range(5, 12)] # 32px to 2048px render heights
+MIP_DIR = "mip"
+
+def mipPath(symbolsDir: str, id: int, size: int) -> str:
+    return os.path.join(symbolsDir, MIP_DIR, str(size), f"{id}.png")
+
+def nearestMipSize(height: float) -> int:
+    # Smallest level that is at least as tall as requested so we only ever downscale, largest level if none are
+    for size in MIP_SIZES:
+        if size >= height:
+            return size
+    return MIP_SIZES[-1]
+
+def fillColor(im: Image.Image, color: tuple) -> Image.Image:
+    # Colour every pixel, not just the visible ones, so rotating/resizing never blends in black from transparent areas
+    data = np.array(im.convert('RGBA'))
+    data[..., :-1] = color
+    return Image.fromarray(data)
+
+def loadMip(symbolsDir: str, id: int, height: float) -> Image.Image|None:
+    path = mipPath(symbolsDir, id, nearestMipSize(height))
+    if not os.path.isfile(path):
+        return None
+    with Image.open(path) as im:
+        im.load()
+        return im.convert('RGBA')
@@ -18,8 +18,18 @@
 #   "status": "closes"
 # }
 import os
+from datetime import datetime
+from sharedState import SharedState
 
 # Cd to this dir for safety, ensure smooth running
 abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
 os.chdir(dname)
+
+def main(state: SharedState, cardData=None, imageCount=None):
+    # Issues are checked against whatever generation is live, follow the shared record instead of reading the cards folder
+    sequence = 0
+    while True:
+        state.waitForChange(sequence)
+        sequence = state.sequence()
+        print(f"[{datetime.now().strftime('%d-%m-%Y %H:%M:%S.%f')[:-3]}] issues now answer for {state.read()}")
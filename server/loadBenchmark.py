@@ -0,0 +1,284 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# HTTP load benchmark for flaskImageProviderApp
+# Drives a mixed, roughly realistic traffic pattern (hot cards, a long tail of icons, revalidations, 404 scans, varied
+# Accept headers) against the app and reports throughput and p50/p95/p99 latency per route.
+#
+#   python loadBenchmark.py --mode testclient            in process, measures the app without any server
+#   python loadBenchmark.py --mode waitress -c 32        real sockets against waitress on a free port
+#   python loadBenchmark.py --mode asyncio -c 32         same against asyncServer.py
+#   python loadBenchmark.py --mode all --save-baseline   store results in bench_baselines/<mode>.json
+#   python loadBenchmark.py --mode all --compare         exits with 1 if a route regressed past --threshold
+#
+# Needs card images in `cards`, run readmeManager once before benchmarking
+
+import generator.startup as startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import os
+import threading
+import time
+import numpy as np
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+os.chdir(dname)
+
+BASELINE_DIR = os.path.join(dname, "bench_baselines")
+MODES = ("testclient", "waitress", "asyncio")
+ACCEPT_HEADERS = [ # (weight, Accept)
+    (40, "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"), # Chromium <img>
+    (25, "image/webp,*/*"), # GitHub's camo proxy
+    (15, "*/*"), # curl and friends
+    (10, "image/png"),
+    (5, "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"), # Someone opened the url in a tab
+    (5, "application/json"),
+]
+ACCEPT_ENCODINGS = ["gzip, deflate, br", "gzip", ""]
+SCAN_PATHS = [
+    "/wp-login.php", "/.env", "/admin", "/monomatch/icon/png/999999", "/monomatch/card/gif/0", "/monomatch/card/png/7",
+    "/monomatch/icon/jpg/3", "/monomatch/icon/png/-1", "/monomatch/icon/png", "/monomatch/sprite/gif",
+]
+ROUTE_WEIGHTS = { # Share of requests per route label
+    "card": 30,
+    "icon": 40,
+    "revalidate": 10,
+    "scan": 10,
+    "favicon": 5,
+    "sprite": 5,
+}
+
+def pick(rng: np.random.Generator, weighted: list[tuple]) -> object:
+    weights = np.array([i[0] for i in weighted], dtype=float)
+    return weighted[rng.choice(len(weighted), p=weights/weights.sum())][1]
+
+def makeRequests(count: int, symbolCount: int, seed: int=0) -> list[tuple[str, str, dict]]:
+    # (route label, path, headers), fixed by the seed so every mode and run sees the same traffic
+    rng = np.random.default_rng(seed)
+    routes = list(ROUTE_WEIGHTS.items())
+    requests = []
+    for _ in range(count):
+        route = pick(rng, [(weight, name) for name, weight in routes])
+        headers = {"Accept": pick(rng, ACCEPT_HEADERS), "Accept-Encoding": ACCEPT_ENCODINGS[rng.integers(len(ACCEPT_ENCODINGS))]}
+        match route:
+            case "card":
+                path = f"/monomatch/card/{rng.choice(['png', 'webp', 'auto'])}/{rng.integers(2)}"
+            case "icon" | "revalidate":
+                id = min(int(rng.zipf(1.3)) - 1, symbolCount - 1) # A few symbols are hot, most are rarely asked for
+                path = f"/monomatch/icon/{rng.choice(['png', 'webp', 'svg', 'auto'])}/{id}"
+            case "scan":
+                path = SCAN_PATHS[rng.integers(len(SCAN_PATHS))]
+            case "favicon":
+                path = "/favicon.ico"
+            case "sprite":
+                path = f"/monomatch/sprite/{rng.choice(['auto', 'json'])}"
+        requests.append((route, path, headers))
+    return requests
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[int, int]] = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, status: int, size: int):
+        with self.lock:
+            self.samples.setdefault(route, []).append(seconds)
+            statuses = self.statuses.setdefault(route, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            self.bytes += size
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            ms = np.array(samples) * 1000
+            routes[route] = {
+                "count": len(samples),
+                "p50": float(np.percentile(ms, 50)),
+                "p95": float(np.percentile(ms, 95)),
+                "p99": float(np.percentile(ms, 99)),
+                "statuses": {str(k): v for k, v in sorted(self.statuses[route].items())},
+            }
+        total = sum(i["count"] for i in routes.values())
+        return {"requests": total, "seconds": elapsed, "rps": total / elapsed if elapsed else 0, "bytes": self.bytes, "routes": routes}
+
+def revalidationHeaders(etags: dict[str, str], path: str, headers: dict) -> dict:
+    if path in etags:
+        return {**headers, "If-None-Match": etags[path]}
+    return headers
+
+def runTestClient(app, requests: list, concurrency: int) -> dict:
+    client = app.test_client()
+    recorder = Recorder()
+    etags = {}
+    start = time.perf_counter()
+    for route, path, headers in requests:
+        if route == "revalidate":
+            headers = revalidationHeaders(etags, path, headers)
+        t = time.perf_counter()
+        response = client.get(path, headers=headers)
+        size = len(response.get_data())
+        recorder.add(route, time.perf_counter() - t, response.status_code, size)
+        if "ETag" in response.headers:
+            etags[path] = response.headers["ETag"]
+    return recorder.report(time.perf_counter() - start)
+
+def runHttp(port: int, requests: list, concurrency: int) -> dict:
+    # Each worker keeps one keep-alive connection and takes every concurrency-th request
+    recorder = Recorder()
+    def worker(offset: int):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        etags = {}
+        for route, path, headers in requests[offset::concurrency]:
+            if route == "revalidate":
+                headers = revalidationHeaders(etags, path, headers)
+            t = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                size = len(response.read())
+                status = response.status
+                if response.getheader("ETag"):
+                    etags[path] = response.getheader("ETag")
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                size, status = 0, 0 # Counted as a failed request
+            recorder.add(route, time.perf_counter() - t, status, size)
+        connection.close()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return recorder.report(time.perf_counter() - start)
+
+def startWaitress(app) -> tuple[int, callable]:
+    from waitress import wasyncore
+    from waitress.server import create_server
+    server = create_server(app, host="127.0.0.1", port=0, threads=4)
+    def stop():
+        # Closing sockets from this thread pulls them out from under the loop's select, stop the workers
+        # and then close everything from inside the loop so it returns on its own
+        server.task_dispatcher.shutdown()
+        server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+        thread.join()
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    return server.effective_port, stop
+
+def startAsyncio(app) -> tuple[int, callable]:
+    from asyncServer import AsyncWSGIServer
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+    async def run():
+        server = state["server"] = await AsyncWSGIServer(app, host="127.0.0.1", port=0).start()
+        state["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass # Closing the server cancels serve_forever, that's the normal way out
+    async def shutdown():
+        state["server"].close()
+        await state["server"].wait_closed()
+    def stop():
+        # Stopping the loop under run_until_complete would leave run() pending and raise, close the server from inside instead
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        thread.join()
+        loop.close()
+    thread = threading.Thread(target=lambda: loop.run_until_complete(run()), daemon=True)
+    thread.start()
+    ready.wait()
+    return state["port"], stop
+
+def runMode(mode: str, app, requests: list, concurrency: int) -> dict:
+    if mode == "testclient":
+        return runTestClient(app, requests, concurrency)
+    port, stop = startWaitress(app) if mode == "waitress" else startAsyncio(app)
+    try:
+        runHttp(port, requests[:max(1, len(requests)//10)], concurrency) # Warm up connections, caches and the fd cache
+        return runHttp(port, requests, concurrency)
+    finally:
+        stop()
+
+def printReport(mode: str, result: dict):
+    print(f"\n{mode}: {result['requests']} requests in {result['seconds']:.2f}s, {result['rps']:.0f} req/s, {result['bytes']/1024/1024:.1f}MiB")
+    print(f"  {'route':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for route, stats in result["routes"].items():
+        statuses = ", ".join(f"{k}x{v}" for k, v in stats["statuses"].items())
+        print(f"  {route:<12}{stats['count']:>8}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}  {statuses}")
+
+def compare(mode: str, result: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    if result["rps"] < baseline["rps"] * (1-threshold):
+        regressions.append(f"{mode}: throughput {result['rps']:.0f} req/s vs {baseline['rps']:.0f} baseline")
+    for route, stats in result["routes"].items():
+        old = baseline["routes"].get(route)
+        if old is None:
+            continue
+        for key in ("p50", "p95", "p99"):
+            if stats[key] > old[key] * (1+threshold):
+                regressions.append(f"{mode}/{route}: {key} {stats[key]:.2f}ms vs {old[key]:.2f}ms baseline")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load benchmark for the image provider routes")
+    parser.add_argument("--mode", choices=[*MODES, "all"], default="testclient")
+    parser.add_argument("-n", "--requests", type=int, default=5000, help="Requests per mode")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Client connections for the socket modes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write results to {os.path.relpath(BASELINE_DIR, dname)}/<mode>.json")
+    parser.add_argument("--compare", action="store_true", help="Compare against the stored baseline, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before --compare fails, 0.2 = 20%%")
+    parser.add_argument("--admission", action="store_true", help="Keep rate limiting on, every request comes from one address so most get a 429")
+    args = parser.parse_args()
+
+    if not args.admission:
+        os.environ["MONOMATCH_ADMISSION"] = "0" # Read when the app is imported
+
+    import flaskImageProviderApp as fipa
+    import logging
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR) # Queue depth warnings are the point of a load test
+    fipa.loadAssets()
+    requests = makeRequests(args.requests, fipa.assets.symbolCount(), args.seed)
+
+    regressions = []
+    for mode in MODES if args.mode == "all" else [args.mode]:
+        result = runMode(mode, fipa.app, requests, args.concurrency)
+        result["concurrency"] = args.concurrency
+        printReport(mode, result)
+        path = os.path.join(BASELINE_DIR, f"{mode}.json")
+        if args.compare:
+            if os.path.isfile(path):
+                with open(path) as f:
+                    regressions += compare(mode, result, json.load(f), args.threshold)
+            else:
+                print(f"  No baseline for {mode} yet, run with --save-baseline first")
+        if args.save_baseline:
+            os.makedirs(BASELINE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(result, f, indent=2)
+            print(f"  Saved baseline to {path}")
+
+    if len(regressions):
+        print("\nRegressions:")
+        for i in regressions:
+            print(f"  {i}")
+        exit(1)
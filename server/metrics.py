@@ -0,0 +1,153 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# In-process metrics registry rendered in the Prometheus text format (version 0.0.4)
+# The image provider records into REGISTRY and serves it at /metrics.
+# readmeManager runs in another process, it hands card render stage timings over through RENDER_STAGES_FILE which
+# the scrape reads back, so a slow render shows up next to the serving metrics.
+
+import json
+import os
+import threading
+import time
+
+abspath = os.path.abspath(__file__)
+dname = os.path.dirname(abspath)
+
+RENDER_STAGES_FILE = os.path.join(dname, "render_stages.json")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+def escapeLabel(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatLabels(names: tuple, values: tuple, extra: str="") -> str:
+    parts = [f'{name}="{escapeLabel(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if len(parts) else ""
+
+def formatValue(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelNames: tuple=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(i, "") for i in self.labelNames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{formatLabels(self.labelNames, key)} {formatValue(value)}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self, **labels) -> float:
+        # Sum over every series matching the given labels
+        with self.lock:
+            return sum(value for key, value in self.values.items() if all(key[self.labelNames.index(k)] == v for k, v in labels.items()))
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelNames: tuple=(), buckets: tuple=LATENCY_BUCKETS):
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            buckets, count, total = self.values.get(key, ([0]*len(self.buckets), 0, 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    buckets[i] += 1
+            self.values[key] = (buckets, count + 1, total + value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, (buckets, count, total) in sorted(self.values.items()):
+                for bound, bucketCount in [*zip(map(formatValue, self.buckets), buckets), ("+Inf", count)]:
+                    bucketLabel = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{formatLabels(self.labelNames, key, bucketLabel)} {bucketCount}")
+                lines.append(f"{self.name}_sum{formatLabels(self.labelNames, key)} {formatValue(total)}")
+                lines.append(f"{self.name}_count{formatLabels(self.labelNames, key)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.collectors = [] # Called before every render, for values that are read rather than recorded
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelNames: tuple=()) -> Counter:
+        return self.register(Counter(name, help, labelNames))
+
+    def gauge(self, name: str, help: str, labelNames: tuple=()) -> Gauge:
+        return self.register(Gauge(name, help, labelNames))
+
+    def histogram(self, name: str, help: str, labelNames: tuple=(), buckets: tuple=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelNames, buckets))
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+REGISTRY = Registry()
+
+def recordRenderStages(stages: dict[str, float], path: str=RENDER_STAGES_FILE):
+    # Called from readmeManager after every render, keeps the last duration of each stage plus a run counter
+    try:
+        with open(path) as f:
+            runs = json.load(f).get("runs", 0)
+    except (OSError, ValueError):
+        runs = 0
+    tmpPath = f"{path}.tmp.{os.getpid()}"
+    with open(tmpPath, "w") as f:
+        json.dump({"timestamp": time.time(), "runs": runs + 1, "stages": stages}, f)
+    os.replace(tmpPath, path) # The scrape never sees a half written file
+
+def readRenderStages(path: str=RENDER_STAGES_FILE) -> dict|None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -9,25 +9,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import asyncio
-from datetime import date, datetime
-from math import sqrt
-import sched
-import shutil
+import generator.startup as startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+from datetime import datetime
 from generator.gen_monomatch_data import CardData
 from xoshiro256ss import xoroshiro256ss
 import numpy as np
-import sympy
 import os
-import cbor2 as cbor # Using cbor to encode the data for the answers so people can't fudge it easily, has to be statically encoded so an issue can be opened even after the images refresh and still credit the user their points
+cbor = startup.lazyImport("cbor2") # Using cbor to encode the data for the answers so people can't fudge it easily, has to be statically encoded so an issue can be opened even after the images refresh and still credit the user their points
 import base64        # Base 64 encoding is used to make the data work with a gh issue
                      # Before the base64 it should be bit rotated by one fourth rounded down of the length of the cbor
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import warnings
 warnings.filterwarnings("ignore", module="apscheduler") # Fix the warnings from the apscheduler's bad code
-import generator.gen_image as genIm
-from tqdm import tqdm
-from PIL import Image
+import cardGenerations
+import cardCache
+from sharedState import SharedState
+import metrics
+import time
+
+# Only needed once main runs, so importing this module for its functions stays cheap
+apscheduler = startup.lazyImport("apscheduler.schedulers.asyncio")
+spriteSheet = startup.lazyImport("generator.sprite_sheet")
 
 # Cd to this dir for safety, ensure smooth running
 abspath = os.path.abspath(__file__)
@@ -115,11 +119,12 @@ def update_readme(rng: xoroshiro256ss, cardData: CardData, imageCount: int):
     diff = ".".join([*diffParts[:-1], diffParts[-1].ljust(3, "0")[:3]]) if len(diffParts) > 1 else diffParts[0]+".000"
     print(f"[{endTime}] ({diff}) readme")
 
-def update_cards(rng: xoroshiro256ss, cardData: CardData, imageCount: int):
+def stage_cards(rng: xoroshiro256ss, cardData: CardData, imageCount: int):
+    # Renders the next card pair into a fresh generation, nothing is served from it until publish_cards runs
     start = datetime.now()
-    shutil.rmtree("cards", ignore_errors=True)
-    try: os.mkdir("cards")
-    except: pass
+    stages = {}
+    stageStart = time.perf_counter()
+    outDir = cardGenerations.newGeneration()
 
     card1_num = rng.next()%np.uint64(len(cardData.card_data))
     card2_num = rng.next()%np.uint64(len(cardData.card_data))
@@ -131,36 +136,63 @@ def update_cards(rng: xoroshiro256ss, cardData: CardData, imageCount: int):
     card2 = cardData.card_data[card2_num]
 
     print(f"card1: {card1}\ncard2: {card2}")
+    stages["select"], stageStart = time.perf_counter()-stageStart, time.perf_counter()
 
     print("Gen images")
-    card1_im = genIm.Card.generateImage(card1, imageCount, outDimension=2048).cardImage.quantize(256)
-    card2_im = genIm.Card.generateImage(card2, imageCount, outDimension=2048).cardImage.quantize(256)
+    card1_files, card2_files = cardCache.getCards([card1, card2], imageCount) # Renders and encodes only what isn't cached yet
+    stages["render"], stageStart = time.perf_counter()-stageStart, time.perf_counter()
 
     print("Save images")
-    print("PNG 0")
-    card1_im.save(f"cards/0.png", optimize=True)
-    print("PNG 1")
-    card2_im.save(f"cards/1.png", optimize=True)
-    print("Webp 0")
-    card1_im.convert("RGBA").save(f"cards/0.webp", lossless=True, method=6, quality=100)
-    print("Webp 1")
-    card2_im.convert("RGBA").save(f"cards/1.webp", lossless=True, method=6, quality=100)
+    cardCache.copyInto(card1_files, outDir, "0")
+    cardCache.copyInto(card2_files, outDir, "1")
+    stages["save"], stageStart = time.perf_counter()-stageStart, time.perf_counter()
+
+    print("Pack answer sprites")
+    spriteSheet.writeSpriteSheet(sorted(set(int(i) for i in card1) | set(int(i) for i in card2)), outDir)
+    cardGenerations.writeRecord(outDir, [card1_num, card2_num], [cardCache.cardKey(i, imageCount) for i in (card1, card2)])
+    outDir = cardGenerations.finishGeneration(outDir) # Only now can publish_cards see it
+    stages["sprite"] = time.perf_counter()-stageStart
+    stages["total"] = sum(stages.values())
+    metrics.recordRenderStages(stages) # Picked up by the image provider's /metrics
     end = datetime.now()
     endTime = end.strftime('%d-%m-%Y %H:%M:%S.%f')[:-3]
     diffParts = str(end-start).split(".")
     diff = ".".join([*diffParts[:-1], diffParts[-1].ljust(3, "0")[:3]]) if len(diffParts) > 1 else diffParts[0]+".000"
-    print(f"[{endTime}] ({diff}) cards")
-
-def main(rng: xoroshiro256ss, cardData: CardData, imageCount: int):
-    update_cards(rng, cardData, imageCount)
-
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(update_readme, 'cron', kwargs={"rng": rng, "cardData": cardData, "imageCount": imageCount}, minute="10-50/10")
-    scheduler.add_job(update_cards, 'cron', kwargs={"rng": rng, "cardData": cardData, "imageCount": imageCount}, minute="0")
+    print(f"[{endTime}] ({diff}) staged cards")
+    return outDir
+
+def announce(state: SharedState|None, staged: str):
+    # Tells the other processes which generation is live, after the symlink swap so they can serve it straight away
+    record = cardGenerations.readRecord(staged) or {"cards": [], "hashes": []} # Still announced, just without ids
+    if state is not None:
+        state.publish(os.path.basename(staged), record["cards"], record["hashes"])
+
+def publish_cards(rng: xoroshiro256ss, cardData: CardData, imageCount: int, state: SharedState|None=None):
+    staged = cardGenerations.stagedGeneration()
+    if staged is None: # Staging missed its slot, render now rather than skip the rotation
+        staged = stage_cards(rng, cardData, imageCount)
+    cardGenerations.publish(staged)
+    announce(state, staged)
+    print(f"[{datetime.now().strftime('%d-%m-%Y %H:%M:%S.%f')[:-3]}] published cards {os.path.basename(staged)}")
+
+def update_cards(rng: xoroshiro256ss, cardData: CardData, imageCount: int, state: SharedState|None=None):
+    staged = stage_cards(rng, cardData, imageCount)
+    cardGenerations.publish(staged)
+    announce(state, staged)
+
+def main(state: SharedState, cardData: CardData, imageCount: int):
+    rng = state.rng() # Draws go through the shared state so no other process can repeat them
+    jobArgs = {"rng": rng, "cardData": cardData, "imageCount": imageCount}
+    update_cards(**jobArgs, state=state)
+
+    scheduler = apscheduler.AsyncIOScheduler()
+    scheduler.add_job(update_readme, 'cron', kwargs=jobArgs, minute="10-50/10")
+    scheduler.add_job(stage_cards, 'cron', kwargs=jobArgs, minute="50")
+    scheduler.add_job(publish_cards, 'cron', kwargs={**jobArgs, "state": state}, minute="0")
     scheduler.start()
 
     scheduler._eventloop.run_forever()
 
 
 if __name__ == "__main__":
-    main(xoroshiro256ss(), CardData.generateCardDataByCards(500), 0)
+    main(SharedState.create(), CardData.generateCardDataByCards(500), 0)
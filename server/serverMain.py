@@ -9,15 +9,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import server.githubIssueManager as server
-import readmeManager as readme
-import flaskImageProviderApp as fipa
+import generator.startup as startup
+if __name__ == "__main__":
+    startup.profileIfAsked(__file__, __spec__)
+
+import importlib
 import multiprocessing as mp
 
-from generator.gen_monomatch_data import CardData
-from xoshiro256ss import xoroshiro256ss
-import sympy
-from math import sqrt
+import generator.deck_file as deck_file
+from sharedState import SharedState
 import os
 
 # Cd to this dir for safety, ensure smooth running
@@ -25,17 +25,21 @@ abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
 os.chdir(dname)
 
-imageCount = len(filter(lambda x:x.endswith(".svg"), os.listdir("generator/symbols")))
-rng = xoroshiro256ss()
-cardData = CardData.generateCardDataByDimension(
-    sympy.ntheory.generate.prevprime(sqrt(imageCount-sqrt(imageCount)-1)) # The symbol count has been consistently following approximately this pattern
-)
+# Imported by name inside each process, so the web server never loads the renderer and the readme process never loads flask
+PROCESSES = ("githubIssueManager", "readmeManager", "flaskImageProviderApp")
+
+def runProcess(module: str, state: SharedState, cardData, imageCount: int):
+    importlib.import_module(module).main(state, cardData, imageCount)
 
 if __name__ == "__main__": # Windows is dumb and mp needs a guard
     mp.freeze_support()    # Windows needs this too
-    p1 = mp.Process(target=server.main, args=[rng, cardData, imageCount])
-    p1.start()
-    p2 = mp.Process(target=readme.main, args=[rng, cardData, imageCount])
-    p2.start()
-    p3 = mp.Process(target=fipa.main, args=[rng, cardData, imageCount])
-    p3.start()
\ No newline at end of file
+    cardData, imageCount, _ = deck_file.openDeck() # Memory mapped, the child processes map the same file instead of getting a copy
+    state = SharedState.create() # Live card generation and the rng, every process attaches to the same block
+    processes = [mp.Process(target=runProcess, args=[i, state, cardData, imageCount], name=i) for i in PROCESSES]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        state.close(unlink=True)
@@ -0,0 +1,140 @@
+# Copyright 2022 Winter/Vortetty
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+if __name__ == "__main__":
+    print("This is a library. It should not be run directly.")
+    exit(1)
+
+# State shared by every serverMain process through one multiprocessing.shared_memory block
+#   the live card generation record: sequence number, generation name, card ids, card hashes, publish time
+#   the xoroshiro256ss state, so there's one random stream instead of a diverging copy per process
+# Readers never lock, the record is guarded by a seqlock (odd sequence = write in progress, changed = retry).
+# Checking for a new generation is one 8 byte read, processes that want to block instead wait on `changed`.
+# The deck isn't in here, it's already shared without copies through the memory mapped deck file (generator/deck_file.py)
+
+from datetime import datetime
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+import struct
+import time
+import numpy as np
+from xoshiro256ss import xoroshiro256ss
+
+CARD_SLOTS = 2
+RECORD = struct.Struct(f"<Q32s{CARD_SLOTS}q{'32s'*CARD_SLOTS}d") # sequence, generation, card ids, card hashes, published at
+SEQUENCE = struct.Struct("<Q")
+RNG_OFFSET = RECORD.size # 4 uint64 after the record, RECORD.size is a multiple of 8
+SIZE = RNG_OFFSET + 4*8
+READ_RETRIES = 1000 # A write takes microseconds, running out means the writer died mid update
+
+class GenerationRecord:
+    def __init__(self, sequence: int, generation: str, cardIds: list[int], cardHashes: list[str], publishedAt: float):
+        self.sequence = sequence
+        self.generation = generation
+        self.cardIds = cardIds
+        self.cardHashes = cardHashes
+        self.publishedAt = publishedAt
+
+    def __repr__(self) -> str:
+        return f"generation {self.generation} (#{self.sequence}, cards {self.cardIds}, published {datetime.fromtimestamp(self.publishedAt):%d-%m-%Y %H:%M:%S})"
+
+class SharedState:
+    def __init__(self, shm: shared_memory.SharedMemory, lock, changed):
+        self.shm = shm
+        self.lock = lock # Serialises writers and rng draws
+        self.changed = changed # Condition notified after every publish
+
+    @classmethod
+    def create(cls) -> "SharedState":
+        shm = shared_memory.SharedMemory(create=True, size=SIZE)
+        shm.buf[:SIZE] = bytes(SIZE)
+        lock = mp.RLock()
+        state = cls(shm, lock, mp.Condition(lock))
+        state.rngState()[:] = xoroshiro256ss().state # Seeded once here, every process draws from the same stream
+        return state
+
+    def __reduce__(self):
+        # Child processes attach to the same block by name
+        return (attach, (self.shm.name, self.lock, self.changed))
+
+    def close(self, unlink: bool=False):
+        self.shm.close()
+        if unlink:
+            # Spawned children share this process' resource tracker, so their unregister in attach also dropped ours,
+            # registering again keeps unlink's own unregister balanced (the tracker keeps a set, repeats are free)
+            resource_tracker.register(self.shm._name, "shared_memory")
+            self.shm.unlink()
+
+    def sequence(self) -> int:
+        return SEQUENCE.unpack_from(self.shm.buf, 0)[0]
+
+    def read(self) -> GenerationRecord|None:
+        # None until the first publish, or if a consistent copy couldn't be read
+        for _ in range(READ_RETRIES):
+            before = self.sequence()
+            if before % 2 == 0:
+                fields = RECORD.unpack_from(self.shm.buf, 0)
+                if self.sequence() == before:
+                    break
+            time.sleep(0) # Writer is mid update, let it finish
+        else:
+            return None
+        if before == 0:
+            return None
+        ids = [i for i in fields[2:2+CARD_SLOTS] if i >= 0]
+        hashes = [i.hex() for i in fields[2+CARD_SLOTS:2+CARD_SLOTS*2] if any(i)]
+        return GenerationRecord(before // 2, fields[1].rstrip(b"\x00").decode("utf-8"), ids, hashes, fields[2+CARD_SLOTS*2])
+
+    def publish(self, generation: str, cardIds: list[int], cardHashes: list[str], publishedAt: float|None=None):
+        # Missing ids/hashes are padded, a generation without a record is still worth announcing
+        publishedAt = publishedAt if publishedAt is not None else datetime.now().timestamp()
+        cardIds = [*cardIds, *[-1]*(CARD_SLOTS-len(cardIds))]
+        cardHashes = [*cardHashes, *[""]*(CARD_SLOTS-len(cardHashes))]
+        with self.changed:
+            sequence = self.sequence()
+            SEQUENCE.pack_into(self.shm.buf, 0, sequence + 1)
+            RECORD.pack_into(
+                self.shm.buf, 0, sequence + 1, generation.encode("utf-8")[:32],
+                *[int(i) for i in cardIds], *[bytes.fromhex(i)[:32] for i in cardHashes], publishedAt
+            )
+            SEQUENCE.pack_into(self.shm.buf, 0, sequence + 2)
+            self.changed.notify_all()
+
+    def waitForChange(self, sequence: int, timeout: float|None=None) -> bool:
+        # Blocks until the sequence moves past the one given, False on timeout
+        with self.changed:
+            return self.changed.wait_for(lambda: self.sequence() != sequence, timeout)
+
+    def rngState(self) -> np.ndarray:
+        return np.ndarray((4,), dtype=np.uint64, buffer=self.shm.buf, offset=RNG_OFFSET)
+
+    def rng(self) -> "SharedRng":
+        return SharedRng(self)
+
+class SharedRng(xoroshiro256ss):
+    # xoroshiro256ss whose state lives in the shared block, next() is locked so draws from any process never repeat
+    def __init__(self, state: SharedState):
+        self.sharedState = state
+        self.state = state.rngState()
+
+    def next(self) -> np.uint64:
+        with self.sharedState.lock:
+            return super().next()
+
+def attach(name: str, lock, changed) -> SharedState:
+    # The creating process owns the block, an attaching process must not have its resource tracker unlink it or
+    # warn about a leak when it exits
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False) # 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return SharedState(shm, lock, changed)